@@ -0,0 +1,92 @@
+"""
+Micro-benchmark of the report renderers against row count.
+
+Compares the single-pass buffered renderers with the previous approach of
+repeated string concatenation plus a separately joined text list. Runs without
+NetBox:
+
+    python benchmarks/bench_renderers.py --rows 1000 10000 100000
+"""
+import argparse
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from renderers import Column, HTMLTableRenderer, TextRenderer, render_rows  # noqa: E402
+
+COLUMNS = [
+    Column('device', 'Device'),
+    Column('platform', 'Platform'),
+    Column('site', 'Site'),
+    Column('cartwatch', 'Cartwatch'),
+    Column('cartwatch_admin', 'Cartwatch Admin'),
+    Column('last_updated', 'Last Updated'),
+]
+TEMPLATE = (
+    "{device} on {platform} deployed at {site} with cartwatch "
+    "{cartwatch} and cartwatch_admin {cartwatch_admin}"
+)
+
+
+def synthetic_rows(count):
+    for i in range(count):
+        yield (
+            f"server-{i:06d}",
+            "ubuntu-22.04",
+            f"site-{i // 4:05d}",
+            f"3.{i % 7}.{i % 13}",
+            f"1.{i % 5}.0",
+            "2026-10-01T12:00:00",
+        )
+
+
+def concatenation(rows):
+    output = []
+    html = '<table class="table"><thead><tr>'
+    for column in COLUMNS:
+        html += f'<th>{column.header}</th>'
+    html += '</tr></thead><tbody>'
+    for row in rows:
+        output.append(TEMPLATE.format(**dict(zip([c.key for c in COLUMNS], row))))
+        html += f'<tr><td>{row[0]}</td>'
+        for value in row[1:-1]:
+            html += f'<td>{value}</td>'
+        html += f'<td>{row[-1]}</td></tr>'
+    html += '</tbody></table>'
+    return html, '\n'.join(output)
+
+
+def single_pass(rows):
+    html = HTMLTableRenderer(COLUMNS)
+    text = TextRenderer(COLUMNS, TEMPLATE)
+    render_rows(rows, [html, text])
+    return html.getvalue(), text.getvalue()
+
+
+def measure(func, count):
+    tracemalloc.start()
+    start = time.perf_counter()
+    func(synthetic_rows(count))
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--rows', type=int, nargs='+', default=[1000, 10000, 100000])
+    args = parser.parse_args()
+
+    print(f"{'rows':>8} {'method':<14} {'seconds':>9} {'peak MiB':>9}")
+    for count in args.rows:
+        for name, func in (('concatenation', concatenation), ('single-pass', single_pass)):
+            elapsed, peak = measure(func, count)
+            print(f"{count:>8} {name:<14} {elapsed:>9.3f} {peak / 2**20:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,117 @@
+"""
+Synthetic NetBox data for the benchmarks.
+
+build_fleet() creates a fleet with bulk inserts: one site per ten devices,
+each with its own VRF and camera/POS prefixes carved from a container pool,
+and servers tagged for Tailscale and Cartwatch with one interface and IP
+each. Call it inside a transaction that is rolled back afterwards.
+"""
+import random
+
+from django.contrib.contenttypes.models import ContentType
+from dcim.choices import DeviceStatusChoices, SiteStatusChoices
+from dcim.models import Device, DeviceRole, DeviceType, Interface, Manufacturer, Platform, Site
+from extras.models import Tag, TaggedItem
+from ipam.choices import PrefixStatusChoices
+from ipam.models import IPAddress, Prefix, VRF
+from tenancy.models import ContactRole
+
+DEVICES_PER_SITE = 10
+STORAGE_SITE_NAME = "Storage Site"
+POOL = '10.0.0.0/8'
+
+
+class Fleet:
+
+    def __init__(self):
+        self.sites = []
+        self.devices = []
+        self.storage_site = None
+        self.role = None
+        self.contact_role = None
+        self.pool = None
+
+    @property
+    def hostnames(self):
+        return [device.name for device in self.devices]
+
+
+def build_fleet(device_count, seed=0):
+    rng = random.Random(seed)
+    fleet = Fleet()
+
+    manufacturer = Manufacturer.objects.create(name='Bench Manufacturer', slug='bench-manufacturer')
+    device_type = DeviceType.objects.create(manufacturer=manufacturer, model='Bench Server', slug='bench-server')
+    fleet.role = DeviceRole.objects.filter(name__iexact='server').first() or \
+        DeviceRole.objects.create(name='server', slug='server')
+    platforms = [
+        Platform.objects.create(name=f'bench-os-{i}', slug=f'bench-os-{i}') for i in range(3)
+    ]
+    tags = [
+        Tag.objects.get_or_create(name=name, defaults={'slug': name})[0]
+        for name in ('tailscale', 'cartwatch')
+    ]
+    fleet.contact_role = ContactRole.objects.create(name='Bench Contact', slug='bench-contact')
+    fleet.storage_site = Site.objects.filter(name=STORAGE_SITE_NAME).first() or \
+        Site.objects.create(name=STORAGE_SITE_NAME, slug='storage-site')
+    fleet.pool = Prefix.objects.create(prefix=POOL, status=PrefixStatusChoices.STATUS_CONTAINER)
+
+    site_count = max(1, device_count // DEVICES_PER_SITE)
+    fleet.sites = Site.objects.bulk_create([
+        Site(name=f'bench-site-{i:06d}', slug=f'bench-site-{i:06d}', status=SiteStatusChoices.STATUS_ACTIVE)
+        for i in range(site_count)
+    ])
+    vrfs = VRF.objects.bulk_create([
+        VRF(name=f'{site.slug}_vrf', enforce_unique=False) for site in fleet.sites
+    ])
+    # Two /24s per site, packed from the bottom of the pool
+    Prefix.objects.bulk_create([
+        Prefix(
+            prefix=f'10.{(2 * i + offset) >> 8 & 255}.{(2 * i + offset) & 255}.0/24',
+            vrf=vrf,
+            site=site,
+            status=PrefixStatusChoices.STATUS_ACTIVE
+        )
+        for i, (site, vrf) in enumerate(zip(fleet.sites, vrfs))
+        for offset in (0, 1)
+    ])
+
+    fleet.devices = Device.objects.bulk_create([
+        Device(
+            name=f'srv-{i:07d}',
+            device_type=device_type,
+            role=fleet.role,
+            platform=rng.choice(platforms),
+            site=fleet.sites[i % site_count],
+            status=DeviceStatusChoices.STATUS_ACTIVE,
+            custom_field_data={
+                'cartwatch_version': f'3.{rng.randrange(8)}.{rng.randrange(20)}',
+                'cartwatch_admin_version': f'1.{rng.randrange(4)}.0',
+                'cartwatch_last_updated': '2026-10-01T12:00:00',
+            }
+        )
+        for i in range(device_count)
+    ], batch_size=2000)
+
+    device_type_ct = ContentType.objects.get_for_model(Device)
+    TaggedItem.objects.bulk_create([
+        TaggedItem(content_type=device_type_ct, object_id=device.pk, tag=tag)
+        for device in fleet.devices
+        for tag in tags
+    ], batch_size=5000)
+
+    interfaces = Interface.objects.bulk_create([
+        Interface(device=device, name='tailscale0', type='virtual')
+        for device in fleet.devices
+    ], batch_size=5000)
+    interface_ct = ContentType.objects.get_for_model(Interface)
+    IPAddress.objects.bulk_create([
+        IPAddress(
+            address=f'100.{64 + (i >> 16) % 64}.{(i >> 8) & 255}.{i & 255}/32',
+            assigned_object_type=interface_ct,
+            assigned_object_id=interface.pk
+        )
+        for i, interface in enumerate(interfaces)
+    ], batch_size=5000)
+
+    return fleet
@@ -0,0 +1,263 @@
+"""
+Benchmark the scripts against synthetic NetBox data.
+
+For each fleet size, synthetic data is generated inside a transaction, each
+scenario runs in its own rolled-back savepoint, and the whole fleet is rolled
+back at the end. Tailscale and Confluence are served by local stubs. Per
+scenario the wall time, SQL query count and time, peak Python memory and
+HTTP calls are recorded to a JSON file for comparison between versions.
+
+Run with the NetBox virtualenv against a disposable database:
+
+    python benchmarks/run_benchmarks.py --netbox /opt/netbox/netbox --sizes 1000 10000 100000
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCH_DIR)
+
+
+class Rollback(Exception):
+    pass
+
+
+class QueryCounter:
+    """connection.execute_wrapper() callback counting queries and their time."""
+
+    def __init__(self):
+        self.count = 0
+        self.elapsed = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.elapsed += time.perf_counter() - start
+
+
+def setup_django(netbox_root):
+    sys.path.insert(0, netbox_root)
+    sys.path.insert(0, REPO_DIR)
+    sys.path.insert(0, BENCH_DIR)
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'netbox.settings')
+    import django
+    django.setup()
+
+
+def git_revision():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def measure(func, stubs, track_memory=True):
+    from django.core.cache import cache
+    from django.db import connection, transaction
+
+    import refdata
+
+    # Every scenario starts cold: no cached node list, match index, rollup or
+    # reference IDs left by an earlier scenario, so results do not depend on order
+    cache.clear()
+    refdata.clear()
+
+    counter = QueryCounter()
+    for stub in stubs:
+        stub.reset_calls()
+    if track_memory:
+        tracemalloc.start()
+    error = None
+    start = time.perf_counter()
+    try:
+        with connection.execute_wrapper(counter), transaction.atomic():
+            func()
+            transaction.set_rollback(True)
+    except Exception as e:
+        error = f"{type(e).__name__}: {e}"
+    elapsed = time.perf_counter() - start
+    peak = None
+    if track_memory:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+
+    return {
+        'wall_seconds': round(elapsed, 4),
+        'queries': counter.count,
+        'query_seconds': round(counter.elapsed, 4),
+        'peak_memory_bytes': peak,
+        'http_calls': sum(stub.total_calls for stub in stubs),
+        'error': error,
+    }
+
+
+def scenarios(fleet, tailscale_stub):
+    """Return (name, callable) pairs, one per script invocation."""
+    from django.core.files.uploadedfile import SimpleUploadedFile
+
+    from device_platforms import DocumentCartwatchVersions
+    from new_site import BulkCreateSitesScript, CreateSiteWithSubnetsScript
+    from retire_site import MoveDevicesAndDecommissionSite
+    from tailscale import TailscaleStatusSync
+
+    TailscaleStatusSync.API_URL = tailscale_stub.url
+    MoveDevicesAndDecommissionSite.DEVICE_ROLE_NAME = fleet.role.name
+
+    def tailscale(bulk, commit=True):
+        def run():
+            TailscaleStatusSync().run({
+                'tailscale_api_key': 'bench',
+                'bulk_mode': bulk,
+                'incremental': False,
+                'state_file': '',
+                'strip_suffixes': '',
+            }, commit=commit)
+        return run
+
+    def cartwatch(report='devices', sharding='none'):
+        def run():
+            DocumentCartwatchVersions().run({
+                'update_confluence_page': True,
+                'output_format': 'text',
+                'report': report,
+                'rebuild_rollup': False,
+                'confluence_sharding': sharding,
+            }, commit=True)
+        return run
+
+    def create_site():
+        CreateSiteWithSubnetsScript().run({
+            'site_name': 'bench-new-site',
+            'site_description': '',
+            'physical_address': '',
+            'existing_contact': None,
+            'contact_role': fleet.contact_role,
+            'contact_name': 'Bench Contact',
+            'contact_email': 'bench@example.com',
+            'contact_phone': '',
+            'camera_subnet': '',
+            'pos_subnet': '',
+            'parent_pool': fleet.pool,
+            'allocation_prefix_length': 24,
+            'allow_overlap': False,
+        }, commit=True)
+
+    def bulk_create_sites(rows=100):
+        lines = ['site_name,contact_name,contact_email,camera_subnet,pos_subnet']
+        lines += [f'bench-bulk-{i:04d},Bulk Contact,bulk@example.com,,' for i in range(rows)]
+        upload = SimpleUploadedFile('sites.csv', '\n'.join(lines).encode())
+
+        def run():
+            BulkCreateSitesScript().run({
+                'site_file': upload,
+                'contact_role': fleet.contact_role,
+                'parent_pool': fleet.pool,
+                'allocation_prefix_length': 24,
+                'allow_overlap': False,
+            }, commit=True)
+        return run
+
+    def retire_site(commit=True):
+        def run():
+            MoveDevicesAndDecommissionSite().run({
+                'decommission_site': fleet.sites[0],
+                'delete_site': True,
+            }, commit=commit)
+        return run
+
+    return [
+        ('tailscale_sync', tailscale(bulk=False)),
+        ('tailscale_sync_bulk', tailscale(bulk=True)),
+        ('tailscale_sync_dry_run', tailscale(bulk=True, commit=False)),
+        ('cartwatch_report', cartwatch()),
+        ('cartwatch_rollup', cartwatch('rollup')),
+        ('cartwatch_sharded', cartwatch(sharding='site')),
+        ('create_site', create_site),
+        ('bulk_create_sites_100', bulk_create_sites()),
+        ('retire_site', retire_site()),
+        ('retire_site_dry_run', retire_site(commit=False)),
+    ]
+
+
+def run_size(size, track_memory, only=None):
+    from django.conf import settings
+    from django.db import transaction
+
+    from fixtures import build_fleet
+    from stub_servers import ConfluenceStub, TailscaleStub
+
+    results = []
+    try:
+        with transaction.atomic():
+            start = time.perf_counter()
+            fleet = build_fleet(size)
+            print(f"[{size}] fleet built in {time.perf_counter() - start:.1f}s", flush=True)
+
+            tailscale_stub = TailscaleStub(fleet.hostnames).start()
+            confluence_stub = ConfluenceStub().start()
+            confluence_stub.create_page('Cartwatch Versions', page_id='3261431823')
+            settings.PLUGINS_CONFIG['netbox_confluence_kb'] = {
+                'confluence_cloud_instance': 'bench',
+                'confluence_user': 'bench',
+                'confluence_token': 'bench',
+                'confluence_base_url': f'{confluence_stub.url}/wiki',
+            }
+            try:
+                for name, func in scenarios(fleet, tailscale_stub):
+                    if only and name not in only:
+                        continue
+                    result = measure(func, [tailscale_stub, confluence_stub], track_memory)
+                    result.update(size=size, scenario=name)
+                    results.append(result)
+                    status = result['error'] or 'ok'
+                    print(
+                        f"[{size}] {name:<24} {result['wall_seconds']:>9.3f}s "
+                        f"{result['queries']:>7} queries {result['http_calls']:>4} http  {status}",
+                        flush=True
+                    )
+            finally:
+                tailscale_stub.stop()
+                confluence_stub.stop()
+            raise Rollback
+    except Rollback:
+        pass
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the NetBox scripts against synthetic data")
+    parser.add_argument('--netbox', required=True, help="Path of the NetBox project directory (containing manage.py)")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 10000, 100000])
+    parser.add_argument('--scenarios', nargs='*', help="Only run these scenarios")
+    parser.add_argument('--no-memory', action='store_true', help="Skip tracemalloc, which slows the scripts down")
+    parser.add_argument('--output', default='bench_results.json')
+    args = parser.parse_args()
+
+    setup_django(args.netbox)
+
+    results = []
+    for size in args.sizes:
+        results.extend(run_size(size, not args.no_memory, args.scenarios))
+
+    with open(args.output, 'w') as f:
+        json.dump({
+            'generated_at': datetime.now(timezone.utc).isoformat(),
+            'git_revision': git_revision(),
+            'results': results,
+        }, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
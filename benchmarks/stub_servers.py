@@ -0,0 +1,163 @@
+"""
+Local HTTP stubs of the Tailscale and Confluence APIs for the benchmarks.
+
+Each stub runs a ThreadingHTTPServer on a free localhost port in a daemon
+thread and counts the requests it served.
+"""
+import json
+import re
+import threading
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class StubServer:
+    """Base class: subclasses implement handle(method, path, headers, body) -> (status, headers, body)."""
+
+    def __init__(self):
+        self.calls = Counter()
+        self.lock = threading.Lock()
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def log_message(self, *args):
+                pass
+
+            def _dispatch(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                body = json.loads(self.rfile.read(length)) if length else None
+                with stub.lock:
+                    stub.calls[self.command] += 1
+                status, headers, payload = stub.handle(self.command, self.path, self.headers, body)
+                data = json.dumps(payload).encode() if payload is not None else b''
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            do_GET = do_PUT = do_POST = _dispatch
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server.server_port}"
+
+    @property
+    def total_calls(self):
+        return sum(self.calls.values())
+
+    def reset_calls(self):
+        with self.lock:
+            self.calls.clear()
+
+    def start(self):
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def handle(self, method, path, headers, body):
+        raise NotImplementedError
+
+
+class TailscaleStub(StubServer):
+    """Serves /tailnet/<tailnet>/devices for the given hostnames with a stable ETag."""
+
+    def __init__(self, hostnames, offline_ratio=0.1):
+        super().__init__()
+        now = datetime.now(timezone.utc)
+        devices = []
+        for i, hostname in enumerate(hostnames):
+            offline = i % int(1 / offline_ratio) == 0 if offline_ratio else False
+            last_seen = now - timedelta(hours=2) if offline else now
+            devices.append({
+                'hostname': hostname,
+                'nodeId': f"n{i:08d}",
+                'addresses': [f"100.{64 + (i >> 16) % 64}.{(i >> 8) & 255}.{i & 255}"],
+                'lastSeen': last_seen.strftime('%Y-%m-%dT%H:%M:%SZ'),
+            })
+        self.payload = {'devices': devices}
+        self.etag = f'"{len(devices)}-{int(now.timestamp())}"'
+
+    def handle(self, method, path, headers, body):
+        if headers.get('If-None-Match') == self.etag:
+            return 304, {'ETag': self.etag}, None
+        return 200, {'ETag': self.etag}, self.payload
+
+
+class ConfluenceStub(StubServer):
+    """
+    Minimal in-memory Confluence content API: pages, child pages and content
+    properties, enough for ConfluencePublisher.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.pages = {}
+        self.properties = {}
+        self.next_id = 1000
+
+    def create_page(self, title, parent_id=None, page_id=None):
+        if page_id is None:
+            page_id = str(self.next_id)
+            self.next_id += 1
+        self.pages[page_id] = {'id': page_id, 'title': title, 'version': 1, 'parent': parent_id, 'body': ''}
+        return page_id
+
+    def handle(self, method, path, headers, body):
+        path = path.split('?')[0]
+        match = re.match(r'^/wiki/rest/api/content(?:/(\d+))?(?:/(property|child/page))?(?:/([\w-]+))?$', path)
+        if not match:
+            return 404, {}, {'message': 'not found'}
+        page_id, sub, key = match.groups()
+
+        with self.lock:
+            if page_id is None and method == 'POST':
+                parent = (body.get('ancestors') or [{}])[0].get('id')
+                new_id = self.create_page(body['title'], parent)
+                self.pages[new_id]['body'] = body['body']['storage']['value']
+                return 200, {}, {'id': new_id, 'title': body['title'], 'version': {'number': 1}}
+            if page_id not in self.pages:
+                return 404, {}, {'message': 'page not found'}
+            page = self.pages[page_id]
+
+            if sub is None:
+                if method == 'GET':
+                    return 200, {}, {
+                        'id': page_id,
+                        'title': page['title'],
+                        'version': {'number': page['version']},
+                        'space': {'key': 'BENCH'},
+                    }
+                if body['version']['number'] != page['version'] + 1:
+                    return 409, {}, {'message': 'version conflict'}
+                page['version'] = body['version']['number']
+                page['title'] = body['title']
+                page['body'] = body['body']['storage']['value']
+                return 200, {}, {'id': page_id, 'version': {'number': page['version']}}
+
+            if sub == 'child/page':
+                children = [
+                    {'id': pid, 'title': p['title']} for pid, p in self.pages.items() if p['parent'] == page_id
+                ]
+                return 200, {}, {'results': children, 'size': len(children), '_links': {}}
+
+            prop_key = key or (body or {}).get('key')
+            stored = self.properties.get((page_id, prop_key))
+            if method == 'GET':
+                if stored is None:
+                    return 404, {}, {'message': 'property not found'}
+                return 200, {}, stored
+            stored = {'key': prop_key, 'value': body['value'], 'version': {'number': (body.get('version') or {}).get('number', 1)}}
+            self.properties[(page_id, prop_key)] = stored
+            return 200, {}, stored
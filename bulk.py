@@ -0,0 +1,112 @@
+"""
+Batched write helpers shared by the scripts.
+
+Calling save() on every object runs the full signal, change logging and event
+pipeline once per row. These helpers write the rows with bulk_update() and
+bulk_create() in batches inside one transaction and record the matching
+ObjectChange entries with a single bulk insert per batch.
+"""
+import time
+from dataclasses import dataclass
+from itertools import islice
+
+from django.db import transaction
+from django.utils import timezone
+from core.choices import ObjectChangeActionChoices
+from core.models import ObjectChange
+from netbox.search.backends import search_backend
+
+DEFAULT_BATCH_SIZE = 500
+
+
+@dataclass
+class BulkWriteStats:
+    rows: int = 0
+    batches: int = 0
+    changes_logged: int = 0
+    elapsed: float = 0.0
+
+    def __str__(self):
+        return (
+            f"{self.rows} rows written in {self.batches} batches "
+            f"({self.changes_logged} change records) in {self.elapsed:.2f}s"
+        )
+
+
+def batched(iterable, size):
+    """Yield lists of at most `size` items from `iterable`."""
+    iterator = iter(iterable)
+    while batch := list(islice(iterator, size)):
+        yield batch
+
+
+def _build_objectchanges(objects, action, request):
+    changes = []
+    for obj in objects:
+        change = obj.to_objectchange(action)
+        if request is not None:
+            change.user = request.user
+            change.user_name = request.user.username
+            change.request_id = request.id
+        changes.append(change)
+    return changes
+
+
+def bulk_update_logged(objects, fields, request=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Write `fields` of `objects` with batched UPDATEs and log one change per row.
+
+    Call obj.snapshot() on each object before modifying it, otherwise the change
+    records will have no pre-change data. Signals and event rules are not fired.
+    """
+    stats = BulkWriteStats()
+    start = time.monotonic()
+    fields = list(fields)
+    now = timezone.now()
+
+    with transaction.atomic():
+        for batch in batched(objects, batch_size):
+            model = type(batch[0])
+            batch_fields = fields
+            if hasattr(model, 'last_updated') and 'last_updated' not in fields:
+                batch_fields = fields + ['last_updated']
+                for obj in batch:
+                    obj.last_updated = now
+
+            model.objects.bulk_update(batch, batch_fields)
+            changes = ObjectChange.objects.bulk_create(
+                _build_objectchanges(batch, ObjectChangeActionChoices.ACTION_UPDATE, request)
+            )
+            stats.rows += len(batch)
+            stats.batches += 1
+            stats.changes_logged += len(changes)
+
+    stats.elapsed = time.monotonic() - start
+    return stats
+
+
+def bulk_create_logged(objects, request=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Insert `objects` with batched INSERTs and log one change per row.
+
+    Primary keys are populated on the passed objects (PostgreSQL returns them
+    from bulk_create), so they can be referenced by subsequent writes. The new
+    objects are added to the global search cache.
+    """
+    stats = BulkWriteStats()
+    start = time.monotonic()
+
+    with transaction.atomic():
+        for batch in batched(objects, batch_size):
+            model = type(batch[0])
+            model.objects.bulk_create(batch)
+            search_backend.cache(batch)
+            changes = ObjectChange.objects.bulk_create(
+                _build_objectchanges(batch, ObjectChangeActionChoices.ACTION_CREATE, request)
+            )
+            stats.rows += len(batch)
+            stats.batches += 1
+            stats.changes_logged += len(changes)
+
+    stats.elapsed = time.monotonic() - start
+    return stats
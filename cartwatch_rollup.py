@@ -0,0 +1,132 @@
+"""
+Materialized rollup of Cartwatch server counts per Cartwatch and
+Cartwatch Admin version, site and platform.
+
+The rollup is kept in the Django cache together with each device's current
+contribution and a cursor into the change log (see change_cursor).
+refresh() only reloads the devices with ObjectChange records newer than the
+cursor, so a rollout that touched a few hundred servers costs a few hundred
+rows instead of a full scan. Site and platform are stored by ID and resolved
+to names when the rollup is rendered, so renaming a site does not invalidate
+it.
+"""
+import time
+from collections import Counter
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.fields.json import KeyTextTransform
+from dcim.choices import DeviceStatusChoices
+from dcim.models import Device, Platform, Site
+
+from change_cursor import refresh_cached
+from refdata import tag_id
+
+CACHE_KEY = 'cartwatch_rollup:v3'
+
+SERVER_STATUSES = [
+    DeviceStatusChoices.STATUS_ACTIVE,
+    DeviceStatusChoices.STATUS_PLANNED,
+    'contract-cancelled',
+    'testing',
+]
+
+
+def cartwatch_servers(server_role_id):
+    """Devices included in the Cartwatch reports."""
+    return Device.objects.filter(
+        status__in=SERVER_STATUSES,
+        tags=tag_id('cartwatch'),
+        role_id=server_role_id
+    )
+
+
+class CartwatchRollup:
+
+    def __init__(self, server_role_id, cursor=0, contributions=None, counts=None, built_at=None):
+        self.server_role_id = server_role_id
+        self.cursor = cursor
+        # device ID -> (cartwatch version, cartwatch admin version, site ID, platform ID)
+        self.contributions = contributions or {}
+        self.counts = counts or Counter()
+        self.built_at = time.time() if built_at is None else built_at
+
+    @staticmethod
+    def _scan(queryset):
+        rows = queryset.annotate(
+            cartwatch_version=KeyTextTransform('cartwatch_version', 'custom_field_data'),
+            cartwatch_admin_version=KeyTextTransform('cartwatch_admin_version', 'custom_field_data'),
+        ).values_list('pk', 'cartwatch_version', 'cartwatch_admin_version', 'site_id', 'platform_id')
+        return {pk: tuple(contribution) for pk, *contribution in rows}
+
+    @classmethod
+    def build(cls, server_role_id):
+        """Scan every Cartwatch server into a new rollup."""
+        contributions = cls._scan(cartwatch_servers(server_role_id))
+        return cls(server_role_id, contributions=contributions, counts=Counter(contributions.values()))
+
+    def changed_devices(self, changes):
+        """IDs of devices with records in `changes`, an ObjectChange queryset."""
+        return set(changes.filter(
+            changed_object_type=ContentType.objects.get_for_model(Device)
+        ).values_list('changed_object_id', flat=True).distinct())
+
+    def apply(self, device_ids, server_role_id):
+        """Replace the contributions of `device_ids` with their current state."""
+        current = self._scan(cartwatch_servers(server_role_id).filter(pk__in=device_ids))
+        for device_id in device_ids:
+            old = self.contributions.pop(device_id, None)
+            if old is not None:
+                self.counts[old] -= 1
+                if not self.counts[old]:
+                    del self.counts[old]
+            new = current.get(device_id)
+            if new is not None:
+                self.contributions[device_id] = new
+                self.counts[new] += 1
+
+    @classmethod
+    def refresh(cls, server_role_id, rebuild=False):
+        """
+        Return an up to date rollup, applying the changes since the cached
+        cursor or rebuilding it. The second value is the number of devices
+        reloaded, or None after a full rebuild.
+        """
+        return refresh_cached(
+            CACHE_KEY,
+            build=lambda: cls.build(server_role_id),
+            changed=cls.changed_devices,
+            apply=lambda rollup, device_ids: rollup.apply(device_ids, server_role_id),
+            rebuild=rebuild,
+            accept=lambda rollup: rollup.server_role_id == server_role_id
+        )
+
+    @property
+    def total(self):
+        return sum(self.counts.values())
+
+    def iter_rows(self):
+        """
+        (version, admin version, site, region, platform, devices) rows ordered
+        by version, admin version, site and platform.
+        """
+        site_ids = {site_id for _, _, site_id, _ in self.counts}
+        platform_ids = {platform_id for _, _, _, platform_id in self.counts if platform_id}
+        sites = {
+            pk: (name, region or 'N/A')
+            for pk, name, region in Site.objects.filter(pk__in=site_ids).values_list('pk', 'name', 'region__name')
+        }
+        platforms = dict(Platform.objects.filter(pk__in=platform_ids).values_list('pk', 'name'))
+
+        rows = [
+            (version or 'N/A', admin_version or 'N/A', *sites.get(site_id, ('N/A', 'N/A')),
+             platforms.get(platform_id, 'N/A'), count)
+            for (version, admin_version, site_id, platform_id), count in self.counts.items()
+        ]
+        rows.sort(key=lambda row: (row[:3], row[4]))
+        return iter(rows)
+
+    def version_totals(self):
+        totals = Counter()
+        for (version, _, _, _), count in self.counts.items():
+            totals[version or 'N/A'] += count
+        return totals
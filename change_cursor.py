@@ -0,0 +1,75 @@
+"""
+Derived state kept in the Django cache and refreshed from the change log.
+
+Some reports are cheaper to maintain than to rebuild: a state object is
+built from a full scan once, stored in the cache with a cursor into the
+ObjectChange table, and later runs only reload the objects with change
+records after the cursor.
+
+Change IDs are assigned when a record is inserted but become visible when
+its transaction commits, so a long transaction can commit records below the
+cursor. refresh_cached() therefore re-reads CURSOR_LOOKBACK change IDs
+behind the cursor (reloading an object twice is harmless), and rebuilds the
+state from scratch once it is older than MAX_AGE as a backstop.
+"""
+import time
+
+from django.core.cache import cache
+from django.db.models import Max
+from core.models import ObjectChange
+
+# Above this many changed objects a full rebuild is cheaper than a refresh
+MAX_INCREMENTAL_OBJECTS = 5000
+
+# Change IDs behind the cursor re-read on every refresh, for late commits
+CURSOR_LOOKBACK = 1000
+
+# Seconds after which the state is rebuilt instead of refreshed
+MAX_AGE = 24 * 3600
+
+
+def latest_change_id():
+    return ObjectChange.objects.aggregate(latest=Max('pk'))['latest'] or 0
+
+
+def rebuild_cached(key, build):
+    """Build the state with `build()`, stamp its cursor and store it under `key`."""
+    # Read the cursor first so changes made during the scan are picked up later
+    cursor = latest_change_id()
+    state = build()
+    state.cursor = cursor
+    state.built_at = time.time()
+    cache.set(key, state, timeout=None)
+    return state
+
+
+def refresh_cached(key, build, changed, apply, rebuild=False, accept=None):
+    """
+    Return the state cached under `key`, brought up to date, and the number
+    of objects reloaded (None after a full rebuild).
+
+    State objects carry `cursor` and `built_at` attributes. `build()` scans
+    from scratch and returns a new state. `changed(state, changes)` returns
+    the IDs of the objects affected by `changes`, an ObjectChange queryset,
+    and `apply(state, ids)` reloads them. `accept(state)` can reject a cached
+    state that was built for other parameters.
+    """
+    state = None if rebuild else cache.get(key)
+    if state is not None and accept is not None and not accept(state):
+        state = None
+    if state is None or time.time() - state.built_at > MAX_AGE:
+        return rebuild_cached(key, build), None
+
+    cursor = latest_change_id()
+    ids = changed(state, ObjectChange.objects.filter(
+        pk__gt=max(state.cursor - CURSOR_LOOKBACK, 0),
+        pk__lte=cursor
+    ))
+    if len(ids) > MAX_INCREMENTAL_OBJECTS:
+        return rebuild_cached(key, build), None
+    if ids:
+        apply(state, ids)
+    if ids or cursor != state.cursor:
+        state.cursor = cursor
+        cache.set(key, state, timeout=None)
+    return state, len(ids)
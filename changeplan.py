@@ -0,0 +1,99 @@
+"""
+Change plans: what a script intends to create, update or delete.
+
+Scripts record their intended changes in a ChangePlan before writing
+anything. Entries with the same action, label and field changes are merged,
+so a plan only holds a count and a bounded number of sample names per entry
+however many objects it covers. In a dry run the plan is rendered as a
+compact diff and nothing is written. On commit its steps are applied in
+order, each writing in batches.
+"""
+import functools
+from itertools import islice
+
+DEFAULT_SAMPLE_SIZE = 10
+
+CREATE = 'create'
+UPDATE = 'update'
+DELETE = 'delete'
+
+SYMBOLS = {CREATE: '+', UPDATE: '~', DELETE: '-'}
+
+
+class PlannedChange:
+
+    def __init__(self, action, label, changes=()):
+        self.action = action
+        self.label = label
+        # (field, old value, new value) tuples
+        self.changes = changes
+        self.count = 0
+        self.samples = []
+
+    def render(self):
+        line = f"{SYMBOLS[self.action]} {self.count} {self.label}"
+        if self.changes:
+            line += " (" + ", ".join(
+                f"{field}: {old} -> {new}" if old is not None else f"{field} -> {new}"
+                for field, old, new in self.changes
+            ) + ")"
+        if self.samples:
+            line += ": " + ", ".join(self.samples)
+            if self.count > len(self.samples):
+                line += f" and {self.count - len(self.samples)} more"
+        return line
+
+
+class ChangePlan:
+
+    def __init__(self, sample_size=DEFAULT_SAMPLE_SIZE):
+        self.sample_size = sample_size
+        self.changes = {}
+        self.steps = []
+
+    def add(self, action, label, count=1, samples=(), changes=None):
+        """
+        Record `count` changes. At most `sample_size` names are kept from
+        `samples`, so pass a sliced queryset rather than a full one.
+        """
+        if not count:
+            return None
+        changes = tuple((field, old, new) for field, (old, new) in (changes or {}).items())
+        key = (action, label, changes)
+        change = self.changes.get(key)
+        if change is None:
+            change = self.changes[key] = PlannedChange(action, label, changes)
+        change.count += count
+        room = self.sample_size - len(change.samples)
+        if room > 0:
+            change.samples.extend(str(sample) for sample in islice(samples, room))
+        return change
+
+    def create(self, label, count=1, samples=()):
+        return self.add(CREATE, label, count, samples)
+
+    def update(self, label, count=1, samples=(), changes=None):
+        """`changes` maps field names to (old, new); use None for an old value that varies."""
+        return self.add(UPDATE, label, count, samples, changes)
+
+    def delete(self, label, count=1, samples=()):
+        return self.add(DELETE, label, count, samples)
+
+    def step(self, func, *args, **kwargs):
+        """Register a write to run when the plan is applied, in registration order."""
+        self.steps.append(functools.partial(func, *args, **kwargs))
+
+    def __len__(self):
+        return sum(change.count for change in self.changes.values())
+
+    def __iter__(self):
+        return iter(self.changes.values())
+
+    def render(self):
+        if not self.changes:
+            return "No changes"
+        return '\n'.join(change.render() for change in self.changes.values())
+
+    def apply(self):
+        """Run the registered steps and return their results."""
+        return [step() for step in self.steps]
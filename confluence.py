@@ -0,0 +1,224 @@
+"""
+Confluence publishing client shared by the scripts.
+
+All requests go through one keep-alive requests.Session with timeouts and
+bounded retries with jittered exponential backoff on connection errors, 429
+and 5xx responses. A hash of the published content is stored as a content
+property on the page, and the page update is skipped when it is unchanged.
+The page version and stored hash can be fetched ahead of time with
+get_page_state(), e.g. on a worker thread while the content is being built.
+publish_many() updates several pages concurrently, sharing the session's
+connection pool.
+"""
+import hashlib
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPBasicAuth
+
+HASH_PROPERTY = 'netbox-content-hash'
+
+PageState = namedtuple('PageState', ['version', 'stored_hash', 'property_version'])
+
+
+class ConfluenceError(Exception):
+    pass
+
+
+def content_hash(text):
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+class ConfluencePublisher:
+    RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+    def __init__(self, base_url, user, token, timeout=(5, 60), max_retries=4,
+                 backoff=0.5, max_backoff=30, pool_size=10):
+        self.api_url = f"{base_url.rstrip('/')}/rest/api"
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+
+        self.session = requests.Session()
+        self.session.auth = HTTPBasicAuth(user, token)
+        self.session.headers.update({
+            'Content-Type': 'application/json',
+            'Accept': 'application/json',
+        })
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    @classmethod
+    def from_plugin_config(cls, plugin='netbox_confluence_kb', **kwargs):
+        """Build a publisher from the Confluence KB plugin settings, or return None if unset."""
+        from netbox.plugins import get_plugin_config
+
+        instance = get_plugin_config(plugin, 'confluence_cloud_instance')
+        user = get_plugin_config(plugin, 'confluence_user')
+        token = get_plugin_config(plugin, 'confluence_token')
+        base_url = get_plugin_config(plugin, 'confluence_base_url')
+        if not base_url and instance:
+            base_url = f"https://{instance}.atlassian.net/wiki"
+        if not base_url or not token:
+            return None
+        return cls(base_url, user, token, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    def _delay(self, attempt, response=None):
+        if response is not None:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                return min(int(retry_after), self.max_backoff)
+        # Full jitter: a random delay up to the exponential backoff ceiling
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def request(self, method, path, expected=(), **kwargs):
+        """
+        Send a request, retrying transient failures. Statuses listed in
+        `expected` are returned instead of raised.
+        """
+        kwargs.setdefault('timeout', self.timeout)
+        url = f"{self.api_url}/{path.lstrip('/')}"
+
+        for attempt in range(self.max_retries + 1):
+            response = None
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except (requests.ConnectionError, requests.Timeout):
+                if attempt == self.max_retries:
+                    raise
+            else:
+                if response.status_code not in self.RETRY_STATUSES or attempt == self.max_retries:
+                    if response.status_code not in expected:
+                        response.raise_for_status()
+                    return response
+            time.sleep(self._delay(attempt, response))
+
+    def get_page(self, page_id, expand='version'):
+        return self.request('GET', f"content/{page_id}", params={'expand': expand}).json()
+
+    def get_child_pages(self, parent_id, limit=200):
+        """Return {title: page ID} of the direct child pages of `parent_id`."""
+        children = {}
+        start = 0
+        while True:
+            data = self.request(
+                'GET', f"content/{parent_id}/child/page", params={'start': start, 'limit': limit}
+            ).json()
+            for page in data['results']:
+                children[page['title']] = page['id']
+            if 'next' not in data.get('_links', {}) or not data['results']:
+                return children
+            start += len(data['results'])
+
+    def create_page(self, space_key, title, body, parent_id=None):
+        """Create a page, under `parent_id` if given, and return its ID."""
+        payload = {
+            'type': 'page',
+            'title': title,
+            'space': {'key': space_key},
+            'body': {
+                'storage': {
+                    'value': body,
+                    'representation': 'storage'
+                }
+            }
+        }
+        if parent_id is not None:
+            payload['ancestors'] = [{'id': parent_id}]
+        return self.request('POST', "content", json=payload).json()['id']
+
+    def get_stored_hash(self, page_id):
+        """Return (hash, property version) of the stored content hash, or (None, None)."""
+        response = self.request('GET', f"content/{page_id}/property/{HASH_PROPERTY}", expected=(404,))
+        if response.status_code == 404:
+            return None, None
+        prop = response.json()
+        return prop['value'].get('sha256'), prop['version']['number']
+
+    def get_page_state(self, page_id):
+        """Fetch the page version and its stored content hash."""
+        stored, property_version = self.get_stored_hash(page_id)
+        return PageState(self.get_page(page_id)['version']['number'], stored, property_version)
+
+    def store_hash(self, page_id, digest, property_version=None):
+        payload = {'key': HASH_PROPERTY, 'value': {'sha256': digest}}
+        if property_version is None:
+            self.request('POST', f"content/{page_id}/property", json=payload)
+        else:
+            payload['version'] = {'number': property_version + 1}
+            self.request('PUT', f"content/{page_id}/property/{HASH_PROPERTY}", json=payload)
+
+    def _page_payload(self, title, body, version):
+        return {
+            'version': {'number': version + 1},
+            'title': title,
+            'type': 'page',
+            'body': {
+                'storage': {
+                    'value': body,
+                    'representation': 'storage'
+                }
+            }
+        }
+
+    def update_page(self, page_id, title, body, version):
+        payload = self._page_payload(title, body, version)
+        return self.request('PUT', f"content/{page_id}", json=payload).json()
+
+    def publish(self, page_id, title, body, fingerprint=None, state=None):
+        """
+        Replace the page body unless its stored hash matches.
+
+        `fingerprint` is the text hashed for change detection. Pass the part of
+        the body without volatile content such as timestamps. Defaults to `body`.
+        `state` is a PageState from get_page_state(); it is fetched here if not
+        given. Returns True if the page was updated.
+        """
+        digest = content_hash(body if fingerprint is None else fingerprint)
+        if state is None:
+            stored, property_version = self.get_stored_hash(page_id)
+            if stored == digest:
+                return False
+            version = self.get_page(page_id)['version']['number']
+        else:
+            version, stored, property_version = state
+            if stored == digest:
+                return False
+
+        response = self.request('PUT', f"content/{page_id}", expected=(409,),
+                                json=self._page_payload(title, body, version))
+        if response.status_code == 409:
+            # The page was edited after the state was fetched, retry on the current version
+            stored, property_version = self.get_stored_hash(page_id)
+            self.update_page(page_id, title, body, self.get_page(page_id)['version']['number'])
+        self.store_hash(page_id, digest, property_version)
+        return True
+
+    def publish_many(self, pages, workers=8, space_key=None, parent_id=None):
+        """
+        Publish (page_id, title, body, fingerprint) tuples concurrently over the
+        shared session. Pages with no ID are created under `parent_id` in
+        `space_key`. Returns {title: True, False or the raised exception}.
+        """
+        def publish(page):
+            page_id, title, body, fingerprint = page
+            try:
+                if page_id is None:
+                    page_id = self.create_page(space_key, title, body, parent_id)
+                    self.store_hash(page_id, content_hash(body if fingerprint is None else fingerprint))
+                    return title, True
+                return title, self.publish(page_id, title, body, fingerprint)
+            except requests.exceptions.RequestException as e:
+                return title, e
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(publish, pages))
@@ -0,0 +1,119 @@
+"""
+Dependency-aware, chunked deletion of a site and everything attached to it.
+
+SiteDeletionPlan resolves every object to delete for a site up front and
+orders the steps so each model is deleted before the objects it depends on
+(IP addresses before devices, devices before racks, prefixes before VRFs).
+Interfaces and other device components are removed by the device deletion
+cascade, which also handles the RESTRICT relation between a parent interface
+and its subinterfaces; the interfaces are still listed as a count-only step.
+counts() gives a dry-run count per model. execute() deletes each step in
+chunks of primary keys, each in its own atomic block, so no single delete
+has to collect the whole site. When the caller already holds a transaction
+(a script job, or one per site in DecommissionMultipleSites) the chunks are
+savepoints, and their row locks are held until the outer transaction
+commits.
+"""
+from collections import Counter
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models import Q
+from dcim.models import Device, Interface, Rack, Site
+from ipam.models import IPAddress, Prefix, VLAN, VRF
+from tenancy.models import ContactAssignment
+
+DEFAULT_CHUNK_SIZE = 500
+
+
+class DeletionStep:
+    """`count_only` steps are deleted by an earlier step's cascade and only counted."""
+
+    def __init__(self, label, model, queryset, count_only=False):
+        self.label = label
+        self.model = model
+        self.queryset = queryset
+        self.count_only = count_only
+
+
+class SiteDeletionPlan:
+    """
+    `keep_devices` is an optional queryset of the site's devices that are moved
+    away before the plan is executed; they and their interfaces and IP
+    addresses are left out of the counts.
+    """
+
+    def __init__(self, site, keep_devices=None):
+        self.site = site
+        self.keep_devices = keep_devices
+        self.steps = self._build_steps()
+
+    def _build_steps(self):
+        site = self.site
+        devices = Device.objects.filter(site=site)
+        if self.keep_devices is not None:
+            devices = devices.exclude(pk__in=self.keep_devices.values('pk'))
+        racks = Rack.objects.filter(site=site)
+        prefixes = Prefix.objects.filter(site=site)
+
+        # VRFs whose prefixes all belong to this site, resolved now because the
+        # prefixes they are derived from are deleted before the VRF step runs
+        vrf_ids = list(
+            VRF.objects.filter(
+                pk__in=prefixes.exclude(vrf=None).values('vrf')
+            ).exclude(
+                pk__in=Prefix.objects.exclude(vrf=None).exclude(site=site).values('vrf')
+            ).values_list('pk', flat=True)
+        )
+
+        ip_addresses = IPAddress.objects.filter(
+            Q(pk__in=IPAddress.objects.filter(interface__device__in=devices).values('pk'))
+            | Q(vrf_id__in=vrf_ids)
+        )
+
+        contact_assignments = ContactAssignment.objects.filter(
+            Q(object_type=ContentType.objects.get_for_model(Site), object_id=site.pk)
+            | Q(object_type=ContentType.objects.get_for_model(Device), object_id__in=devices.values('pk'))
+            | Q(object_type=ContentType.objects.get_for_model(Rack), object_id__in=racks.values('pk'))
+        )
+
+        return [
+            DeletionStep('contact assignments', ContactAssignment, contact_assignments),
+            DeletionStep('IP addresses', IPAddress, ip_addresses),
+            DeletionStep('devices', Device, devices),
+            DeletionStep('interfaces', Interface, Interface.objects.filter(device__in=devices), count_only=True),
+            DeletionStep('racks', Rack, racks),
+            DeletionStep('VLANs', VLAN, VLAN.objects.filter(site=site)),
+            DeletionStep('prefixes', Prefix, prefixes),
+            DeletionStep('VRFs', VRF, VRF.objects.filter(pk__in=vrf_ids)),
+            DeletionStep('sites', Site, Site.objects.filter(pk=site.pk)),
+        ]
+
+    def counts(self):
+        """Return (label, count) for every step, in deletion order."""
+        return [(step.label, step.queryset.count()) for step in self.steps]
+
+    def execute(self, chunk_size=DEFAULT_CHUNK_SIZE, progress=None):
+        """
+        Delete every step in chunks. Returns a Counter of deleted rows per model
+        label, including rows removed by cascades. `progress`, if given, is
+        called as progress(label, deleted_so_far) after each chunk.
+        """
+        deleted = Counter()
+        for step in self.steps:
+            if step.count_only:
+                continue
+            step_deleted = 0
+            while True:
+                pks = list(step.queryset.values_list('pk', flat=True)[:chunk_size])
+                if not pks:
+                    break
+                with transaction.atomic():
+                    count, per_model = step.model.objects.filter(pk__in=pks).delete()
+                if not count:
+                    break
+                deleted.update(per_model)
+                step_deleted += len(pks)
+                if progress is not None:
+                    progress(step.label, step_deleted)
+        return deleted
@@ -1,15 +1,53 @@
-from dcim.models import Device, DeviceRole
 from extras.scripts import *
 from django.utils.html import format_html
 from dcim.choices import DeviceStatusChoices
-from requests.auth import HTTPBasicAuth
 from django.conf import settings
+from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist
+from django.db.models.fields.json import KeyTextTransform
 import requests
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
-from netbox.plugins import get_plugin_config
+from html import escape
 
+from cartwatch_rollup import CartwatchRollup, cartwatch_servers
+from confluence import ConfluencePublisher
+from instrumentation import InstrumentedScriptMixin
+from refdata import device_role_id, tag_id
+from renderers import (
+    Column, CSVRenderer, HTMLTableRenderer, JSONRenderer, ShardedRenderer, TextRenderer, render_rows
+)
 
-class DocumentCartwatchVersions(Script):
+COLUMNS = [
+    Column('device', 'Device'),
+    Column('platform', 'Platform'),
+    Column('site', 'Site'),
+    Column('region', 'Region'),
+    Column('cartwatch', 'Cartwatch'),
+    Column('cartwatch_admin', 'Cartwatch Admin'),
+    Column('last_updated', 'Last Updated'),
+]
+
+TEXT_TEMPLATE = (
+    "{device} on {platform} deployed at {site} with cartwatch "
+    "{cartwatch} and cartwatch_admin {cartwatch_admin}"
+)
+
+ROLLUP_COLUMNS = [
+    Column('cartwatch', 'Cartwatch'),
+    Column('cartwatch_admin', 'Cartwatch Admin'),
+    Column('site', 'Site'),
+    Column('region', 'Region'),
+    Column('platform', 'Platform'),
+    Column('devices', 'Devices'),
+]
+
+ROLLUP_TEXT_TEMPLATE = (
+    "{devices} servers at {site} on {platform} run cartwatch "
+    "{cartwatch} and cartwatch_admin {cartwatch_admin}"
+)
+
+
+class DocumentCartwatchVersions(InstrumentedScriptMixin, Script):
     class Meta:
         description = "Displays all servers with their Cartwatch and Cartwatch_Admin versions"
 
@@ -18,126 +56,261 @@ class DocumentCartwatchVersions(Script):
         default=False
     )
 
-    def update_confluence(self, data, article_body):
-        if data.get('update_confluence_page'):
-            self.log_info("Updating Confluence page")
+    output_format = ChoiceVar(
+        description="Format of the script output",
+        choices=(
+            ('text', 'Text'),
+            ('csv', 'CSV'),
+            ('json', 'JSON'),
+        ),
+        default='text',
+        required=False
+    )
 
-            CONFLUENCE_INSTANCE = get_plugin_config(
-                'netbox_confluence_kb', 'confluence_cloud_instance')
-            CONFLUENCE_USER = get_plugin_config(
-                'netbox_confluence_kb', 'confluence_user')
-            CONFLUENCE_API_TOKEN = get_plugin_config(
-                'netbox_confluence_kb', 'confluence_token')
+    report = ChoiceVar(
+        description="Per-device table, or server counts per Cartwatch version, site and platform",
+        choices=(
+            ('devices', 'Devices'),
+            ('rollup', 'Version rollup'),
+        ),
+        default='devices',
+        required=False
+    )
 
-            CONFLUENCE_AUTH = HTTPBasicAuth(
-                    CONFLUENCE_USER,
-                    CONFLUENCE_API_TOKEN
-                )
+    rebuild_rollup = BooleanVar(
+        description="Rebuild the version rollup from scratch instead of applying recent changes",
+        default=False
+    )
 
-            CONFLUENCE_URL = f"https://{CONFLUENCE_INSTANCE}.atlassian.net/wiki/rest/api/content"
-            CONFLUENCE_PAGE_ID = "3261431823"
+    confluence_sharding = ChoiceVar(
+        description="Publish one table to the Confluence page, or a child page per site or region",
+        choices=(
+            ('none', 'Single page'),
+            ('site', 'Child page per site'),
+            ('region', 'Child page per region'),
+        ),
+        default='none',
+        required=False
+    )
 
-            if not CONFLUENCE_URL or not CONFLUENCE_API_TOKEN:
-                self.log_warning("Confluence URL or token not found in settings")
-                return
+    # Rows fetched per server-side cursor round trip
+    CHUNK_SIZE = 2000
 
-            headers = {
-                'Content-Type': 'application/json'
-            }
+    CONFLUENCE_PAGE_ID = "3261431823"
+    CONFLUENCE_TITLE = 'Cartwatch Versions'
+    # The rollup is published to a child page of CONFLUENCE_PAGE_ID
+    ROLLUP_TITLE = 'Cartwatch Version Rollup'
 
-            confluence_content = f"""
-                <h1>Deployed Cartwatch Versions</h1>
-                <p>Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
-                {article_body}
-                """
-            try:
-                # Get current version
-                response = requests.get(
-                        f"{CONFLUENCE_URL}/{CONFLUENCE_PAGE_ID}",
-                        headers=headers,
-                        auth=CONFLUENCE_AUTH
-                )
-                response.raise_for_status()
-                version = response.json()['version']['number']
-
-                # Update page
-                payload = {
-                    'version': {'number': version + 1},
-                    'title': 'Cartwatch Versions',
-                    'type': 'page',
-                    'body': {
-                            'storage': {
-                                'value': confluence_content,
-                                'representation': 'storage'
-                            }
-                        }
-                    }
-
-                response = requests.put(
-                        f"{CONFLUENCE_URL}/{CONFLUENCE_PAGE_ID}",
-                        headers=headers,
-                        json=payload,
-                        auth=CONFLUENCE_AUTH
-                )
-                response.raise_for_status()
+    # Child pages published in parallel, within the publisher's connection pool
+    PUBLISH_WORKERS = 8
+
+    def confluence_body(self, table, title=None):
+        heading = 'Deployed Cartwatch Versions' if title in (None, self.CONFLUENCE_TITLE) else title
+        return f"""
+            <h1>{heading}</h1>
+            <p>Last updated: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}</p>
+            {table}
+            """
+
+    def report_page(self, publisher, title):
+        """
+        ID of the page a report is published to. The device table owns the
+        configured page; other reports get a child page of it, created empty
+        on first use, so alternating reports do not overwrite each other.
+        """
+        if title == self.CONFLUENCE_TITLE:
+            return self.CONFLUENCE_PAGE_ID
+        page_id = publisher.get_child_pages(self.CONFLUENCE_PAGE_ID).get(title)
+        if page_id is None:
+            parent = publisher.get_page(self.CONFLUENCE_PAGE_ID, expand='space')
+            page_id = publisher.create_page(parent['space']['key'], title, '', parent_id=self.CONFLUENCE_PAGE_ID)
+        return page_id
+
+    def page_target(self, publisher, title):
+        """ID and PageState of the page the report titled `title` is published to."""
+        page_id = self.report_page(publisher, title)
+        return page_id, publisher.get_page_state(page_id)
+
+    def update_confluence(self, publisher, title, article_body, target):
+        """Publish the table. `target` is a future of page_target()."""
+        self.log_info(f"Updating Confluence page '{title}'")
+
+        confluence_content = self.confluence_body(article_body, title)
+        try:
+            page_id, page_state = target.result()
+            # The timestamp is left out of the hash so unchanged tables are not republished
+            updated = publisher.publish(
+                page_id,
+                title,
+                confluence_content,
+                fingerprint=article_body,
+                state=page_state
+            )
+            if updated:
                 self.log_success("Successfully updated Confluence page")
+            else:
+                self.log_info("Confluence page is already up to date, skipped update")
 
-            except requests.exceptions.RequestException as e:
-                self.log_failure(f"Failed to update Confluence page: {str(e)}")
+        except requests.exceptions.RequestException as e:
+            self.log_failure(f"Failed to update Confluence page: {str(e)}")
 
-    def run(self, data, commit):
-        output = []
-        server_role = DeviceRole.objects.get(name='server')
-
-        html = '<table class="table"><thead><tr>'
-        headers = ['Device',
-                   'Platform',
-                   'Site',
-                   'Cartwatch',
-                   'Cartwatch Admin',
-                   'Last Updated'
-                   ]
-
-        for header in headers:
-            html += f'<th>{header}</th>'
-        html += '</tr></thead><tbody>'
-
-        for device in Device.objects.filter(
-            status__in=[
-                DeviceStatusChoices.STATUS_ACTIVE,
-                DeviceStatusChoices.STATUS_PLANNED,
-                'contract-cancelled',
-                'testing',
-            ],
-            tags__name='cartwatch',
-            role=server_role
-        ).order_by('name'):
-
-            ol = (
-                f"{device.name} on "
-                f"{device.platform.name if device.platform else 'N/A'} "
-                f"deployed at {device.site.name} with cartwatch "
-                f"{device.custom_field_data.get('cartwatch_version', 'N/A')} "
-                f"and cartwatch_admin "
-                f"{device.custom_field_data.get('cartwatch_admin_version', 'N/A')}"
+    def shard_targets(self, publisher, title):
+        """ID of the report page, its space key and {title: page ID} of its child pages."""
+        page_id = self.report_page(publisher, title)
+        page = publisher.get_page(page_id, expand='space')
+        return page_id, page['space']['key'], publisher.get_child_pages(page_id)
+
+    def update_confluence_shards(self, publisher, title, shards, targets):
+        """
+        Publish each shard table to its own child page of the report page,
+        creating missing pages, and list the child pages on the report page.
+        `targets` is a future of shard_targets().
+        """
+        self.log_info(f"Updating {len(shards)} Confluence child pages of '{title}'")
+        try:
+            page_id, space_key, children = targets.result()
+        except requests.exceptions.RequestException as e:
+            self.log_failure(f"Failed to read Confluence child pages: {str(e)}")
+            return
+
+        pages = []
+        for key, table in sorted(shards.items()):
+            shard_title = f"{title} - {key}"
+            pages.append((children.get(shard_title), shard_title, self.confluence_body(table, title), table))
+        index = '<ul>' + ''.join(
+            f'<li><ac:link><ri:page ri:content-title="{escape(shard_title)}"/></ac:link></li>'
+            for _, shard_title, _, _ in pages
+        ) + '</ul>'
+        pages.append((page_id, title, self.confluence_body(index, title), index))
+
+        results = publisher.publish_many(
+            pages,
+            workers=self.PUBLISH_WORKERS,
+            space_key=space_key,
+            parent_id=page_id
+        )
+        for page_title, result in results.items():
+            if isinstance(result, Exception):
+                self.log_failure(f"Failed to update Confluence page '{page_title}': {str(result)}")
+        updated = sum(1 for result in results.values() if result is True)
+        unchanged = sum(1 for result in results.values() if result is False)
+        self.log_success(f"Updated {updated} Confluence pages, {unchanged} already up to date")
+
+        # Only shard pages count, other child pages (such as other reports) are left alone
+        stale = {child for child in children if child.startswith(f"{title} - ")} - set(results)
+        if stale:
+            self.log_warning(
+                f"{len(stale)} Confluence child pages no longer have servers: " + ", ".join(sorted(stale))
+            )
+
+    def iter_servers(self, server_role_id):
+        """Stream the rendered columns of every Cartwatch server, joined in one query."""
+        return cartwatch_servers(server_role_id).annotate(
+            cartwatch_version=KeyTextTransform('cartwatch_version', 'custom_field_data'),
+            cartwatch_admin_version=KeyTextTransform('cartwatch_admin_version', 'custom_field_data'),
+            cartwatch_last_updated=KeyTextTransform('cartwatch_last_updated', 'custom_field_data'),
+        ).order_by('name').values_list(
+            'name',
+            'platform__name',
+            'site__name',
+            'site__region__name',
+            'cartwatch_version',
+            'cartwatch_admin_version',
+            'cartwatch_last_updated',
+            named=True
+        ).iterator(chunk_size=self.CHUNK_SIZE)
+
+    def iter_rows(self, server_role_id):
+        """Report rows in COLUMNS order with missing values shown as N/A."""
+        for device in self.iter_servers(server_role_id):
+            yield (
+                device.name,
+                device.platform__name or 'N/A',
+                device.site__name,
+                device.site__region__name or 'N/A',
+                device.cartwatch_version or 'N/A',
+                device.cartwatch_admin_version or 'N/A',
+                device.cartwatch_last_updated or 'N/A',
             )
 
-            html += f'<tr><td>{device.name}</td>'
-            html += f'<td>{device.platform.name if device.platform else "N/A"}</td>'
-            html += f'<td>{device.site.name}</td>'
+    def rollup_rows(self, server_role_id, rebuild=False):
+        """Rows of the version rollup, brought up to date from the change log."""
+        rollup, reloaded = CartwatchRollup.refresh(server_role_id, rebuild=rebuild)
+        if reloaded is None:
+            self.log_info(f"Rebuilt the version rollup from {rollup.total} servers")
+        else:
+            self.log_info(f"Version rollup updated from {reloaded} changed devices")
+        for version, count in sorted(rollup.version_totals().items()):
+            self.log_info(f"Cartwatch {version}: {count} servers")
+        return rollup.iter_rows()
+
+    def run(self, data, commit):
+        # Resolve the reference objects up front, later lookups are served from the cache
+        try:
+            server_role_id = device_role_id('server')
+            tag_id('cartwatch')
+        except ObjectDoesNotExist as e:
+            self.log_warning(f"No Cartwatch servers to report: {e}")
+            return
+        except MultipleObjectsReturned as e:
+            self.log_failure(str(e))
+            return
+        output_format = data.get('output_format') or 'text'
+
+        if data.get('report') == 'rollup':
+            columns, template, title = ROLLUP_COLUMNS, ROLLUP_TEXT_TEMPLATE, self.ROLLUP_TITLE
+            with self.phase('rollup'):
+                rows = self.rollup_rows(server_role_id, rebuild=data.get('rebuild_rollup'))
+        else:
+            columns, template, title = COLUMNS, TEXT_TEMPLATE, self.CONFLUENCE_TITLE
+            rows = self.iter_rows(server_role_id)
 
-            html += f'<td>{device.custom_field_data.get(
-                "cartwatch_version", "N/A")}</td>'
+        if output_format == 'csv':
+            output = CSVRenderer(columns)
+        elif output_format == 'json':
+            output = JSONRenderer(columns)
+        else:
+            output = TextRenderer(columns, template)
+        renderers = [output]
 
-            html += f'<td>{device.custom_field_data.get(
-                "cartwatch_admin_version", "N/A")}</td>'
+        # The HTML table is only needed for Confluence
+        html = None
+        publisher = None
+        sharding = data.get('confluence_sharding') or 'none'
+        if data.get('update_confluence_page'):
+            publisher = ConfluencePublisher.from_plugin_config()
+            if publisher is None:
+                self.log_warning("Confluence URL or token not found in settings")
+            else:
+                self.track_session(publisher.session)
+                if sharding == 'none':
+                    html = HTMLTableRenderer(columns)
+                else:
+                    html = ShardedRenderer(columns, sharding, HTMLTableRenderer)
+                renderers.append(html)
 
-            html += f'<td>{device.custom_field_data.get(
-                "cartwatch_last_updated", "N/A")}</td></tr>'
+        with ThreadPoolExecutor(max_workers=1) as executor:
+            try:
+                # Find the report page and fetch its state (or child pages) while the report is built
+                prefetch = None
+                if publisher is not None:
+                    if sharding == 'none':
+                        prefetch = executor.submit(self.page_target, publisher, title)
+                    else:
+                        prefetch = executor.submit(self.shard_targets, publisher, title)
 
-            output.append(ol)
+                with self.phase('render'):
+                    render_rows(rows, renderers)
 
-        html += '</tbody></table>'
-        self.update_confluence(data, article_body=html)
+                if publisher is not None:
+                    with self.phase('publish'):
+                        if sharding == 'none':
+                            self.update_confluence(publisher, title, html.getvalue(), prefetch)
+                        else:
+                            self.update_confluence_shards(publisher, title, html.getvalue(), prefetch)
+            finally:
+                if publisher is not None:
+                    executor.shutdown()
+                    publisher.close()
 
-        return '\n'.join(output)
+        return output.getvalue()
@@ -0,0 +1,135 @@
+"""
+Query, HTTP and phase instrumentation for the scripts.
+
+Scripts inherit InstrumentedScriptMixin before Script. Their run() method is
+wrapped to count the SQL queries and query time on the job's database
+connection via connection.execute_wrapper(), and to count the HTTP calls and
+latency of every session registered with track_session(). Time spent in
+blocks wrapped with `with self.phase('name'):` is also recorded. A compact
+profile table is appended to the script output. With the cprofile_dump
+option set, a cProfile summary is appended as well and the raw stats are
+written to a file for deeper analysis.
+"""
+import cProfile
+import functools
+import io
+import os
+import pstats
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+
+from django.db import connection
+from extras.scripts import BooleanVar
+
+
+class RunProfile:
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.phases = {}
+        self.db_queries = 0
+        self.db_time = 0.0
+        self.http_calls = 0
+        self.http_time = 0.0
+        self.total = 0.0
+
+    def query_wrapper(self, execute, sql, params, many, context):
+        start = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_queries += 1
+            self.db_time += time.perf_counter() - start
+
+    def _on_response(self, response, *args, **kwargs):
+        with self.lock:
+            self.http_calls += 1
+            self.http_time += response.elapsed.total_seconds()
+
+    def track_session(self, session):
+        """Count every response received through a requests.Session."""
+        session.hooks['response'].append(self._on_response)
+        return session
+
+    @contextmanager
+    def phase(self, name):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases[name] = self.phases.get(name, 0.0) + time.perf_counter() - start
+
+    def render(self):
+        lines = [
+            "Profile",
+            f"  {'total':<16} {self.total:>9.3f}s",
+        ]
+        for name, elapsed in self.phases.items():
+            lines.append(f"  {name:<16} {elapsed:>9.3f}s")
+        lines.append(f"  {'db':<16} {self.db_time:>9.3f}s  {self.db_queries} queries")
+        lines.append(f"  {'http':<16} {self.http_time:>9.3f}s  {self.http_calls} calls")
+        return '\n'.join(lines)
+
+
+def _instrument(run):
+
+    @functools.wraps(run)
+    def wrapper(self, data, commit):
+        self.profile = RunProfile()
+        profiler = cProfile.Profile() if data.get('cprofile_dump') else None
+
+        start = time.perf_counter()
+        with connection.execute_wrapper(self.profile.query_wrapper):
+            if profiler is not None:
+                profiler.enable()
+            try:
+                output = run(self, data, commit)
+            finally:
+                if profiler is not None:
+                    profiler.disable()
+                self.profile.total = time.perf_counter() - start
+
+        sections = [output.rstrip('\n')] if output else []
+        sections.append(self.profile.render())
+        if profiler is not None:
+            sections.append(self.dump_cprofile(profiler))
+        return '\n\n'.join(sections) + '\n'
+
+    wrapper._instrumented = True
+    return wrapper
+
+
+class InstrumentedScriptMixin:
+
+    cprofile_dump = BooleanVar(
+        description="Profile the run with cProfile and append the top functions to the output",
+        default=False
+    )
+
+    # Number of functions listed in the cProfile summary
+    CPROFILE_LIMIT = 25
+
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        run = cls.__dict__.get('run')
+        if run is not None and not getattr(run, '_instrumented', False):
+            cls.run = _instrument(run)
+
+    def phase(self, name):
+        return self.profile.phase(name)
+
+    def track_session(self, session):
+        return self.profile.track_session(session)
+
+    def dump_cprofile(self, profiler):
+        fd, path = tempfile.mkstemp(prefix=f"{type(self).__name__}-", suffix='.prof')
+        os.close(fd)
+        profiler.dump_stats(path)
+        self.log_info(f"cProfile stats written to {path}")
+
+        stream = io.StringIO()
+        pstats.Stats(profiler, stream=stream).sort_stats('cumulative').print_stats(self.CPROFILE_LIMIT)
+        return stream.getvalue().strip()
@@ -0,0 +1,119 @@
+"""
+Append-only log of device liveness transitions.
+
+Each record is a fixed-size struct of (device ID, UNIX timestamp, online) and
+is only written when a device's verdict differs from its last record, so the
+file grows with state changes rather than with sync runs. Writers hold an
+exclusive fcntl lock while they read the last known states and append;
+readers take a shared lock. Uptime and flap counts over a window are computed
+from the transitions alone.
+"""
+import fcntl
+import os
+import struct
+import time
+from collections import defaultdict
+
+RECORD = struct.Struct('<IqB')
+
+
+class DeviceAvailability:
+    """Availability of one device over a window."""
+
+    def __init__(self, device_id, online_seconds, known_seconds, flaps, online):
+        self.device_id = device_id
+        self.online_seconds = online_seconds
+        # Time covered by the log; earlier time in the window is unknown
+        self.known_seconds = known_seconds
+        self.flaps = flaps
+        self.online = online
+
+    @property
+    def uptime(self):
+        """Percentage of the known time the device was online, or None if unknown."""
+        if not self.known_seconds:
+            return None
+        return 100.0 * self.online_seconds / self.known_seconds
+
+
+class LivenessLog:
+
+    def __init__(self, path):
+        self.path = path
+
+    def _read(self, f):
+        data = f.read()
+        # Ignore a partial record left by an interrupted write
+        data = data[:len(data) - len(data) % RECORD.size]
+        return RECORD.iter_unpack(data)
+
+    def history(self, device_ids=None):
+        """Return {device_id: [(timestamp, online), ...]} in log order."""
+        history = defaultdict(list)
+        try:
+            f = open(self.path, 'rb')
+        except FileNotFoundError:
+            return history
+        with f:
+            fcntl.flock(f, fcntl.LOCK_SH)
+            for device_id, timestamp, online in self._read(f):
+                if device_ids is None or device_id in device_ids:
+                    history[device_id].append((timestamp, bool(online)))
+        return history
+
+    def record(self, states, timestamp=None):
+        """
+        Append a transition for every device in `states` ({device_id: online})
+        whose verdict changed. Returns the number of records written.
+        """
+        timestamp = int(time.time() if timestamp is None else timestamp)
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT | os.O_APPEND, 0o644)
+        with os.fdopen(fd, 'r+b') as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            last = {device_id: bool(online) for device_id, _, online in self._read(f)}
+            # Drop a partial record left by an interrupted write, appending after it would misalign the log
+            size = f.tell()
+            if size % RECORD.size:
+                f.truncate(size - size % RECORD.size)
+            records = b''.join(
+                RECORD.pack(device_id, timestamp, online)
+                for device_id, online in sorted(states.items())
+                if last.get(device_id) != bool(online)
+            )
+            if records:
+                f.write(records)
+                f.flush()
+                os.fsync(f.fileno())
+        return len(records) // RECORD.size
+
+    def availability(self, start, end=None, device_ids=None):
+        """Return {device_id: DeviceAvailability} for the window [start, end)."""
+        end = time.time() if end is None else end
+        result = {}
+        for device_id, transitions in self.history(device_ids).items():
+            online_seconds = 0.0
+            known_seconds = 0.0
+            flaps = 0
+            state = None
+            since = None
+            for timestamp, online in transitions:
+                if timestamp >= end:
+                    break
+                if timestamp > start:
+                    if state is not None:
+                        span = timestamp - max(since, start)
+                        known_seconds += span
+                        if state:
+                            online_seconds += span
+                    if state is not None and state != online:
+                        flaps += 1
+                state = online
+                since = timestamp
+            if state is not None:
+                span = end - max(since, start)
+                if span > 0:
+                    known_seconds += span
+                    if state:
+                        online_seconds += span
+            result[device_id] = DeviceAvailability(device_id, online_seconds, known_seconds, flaps, state)
+        return result
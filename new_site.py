@@ -1,3 +1,7 @@
+import csv
+import io
+
+import yaml
 from django.utils.text import slugify
 from dcim.models import Site
 from tenancy.models import Contact, ContactAssignment, ContactRole
@@ -6,10 +10,117 @@ from extras.scripts import *
 from ipam.models import VRF, Prefix
 from dcim.choices import DeviceStatusChoices, SiteStatusChoices
 from django.core.exceptions import ValidationError
+from django.db import transaction
+from django.db.models import Q
 from netaddr import IPNetwork, AddrFormatError
 
+from bulk import bulk_create_logged, bulk_update_logged
+from changeplan import ChangePlan
+from instrumentation import InstrumentedScriptMixin
+from prefix_index import PrefixIndex
+
+SUBNET_FIELDS = ['camera_subnet', 'pos_subnet']
+
+
+def validate_network_prefix(prefix):
+    """Validate and normalize the network prefix, adding /24 if needed."""
+    try:
+        # Check if the input contains a CIDR prefix
+        if '/' not in prefix:
+            prefix += '/24'  # Automatically add /24 if no prefix is given
+
+        # Validate the network prefix
+        network = IPNetwork(prefix)  # Will raise an error if invalid
+        return network.cidr  # Return the network with any host bits cleared
+    except AddrFormatError:
+        raise ValidationError(f"'{prefix}' is not a valid network prefix.")
+
+
+def related_prefixes(networks):
+    """Existing prefixes containing, equal to or inside any of `networks`."""
+    query = Q()
+    for network in networks:
+        query |= Q(prefix__net_contains_or_equals=str(network)) | Q(prefix__net_contained=str(network))
+    return Prefix.objects.filter(query)
+
+
+def find_subnet_conflicts(networks, index):
+    """Return messages for networks colliding with each other or with prefixes in `index`."""
+    problems = []
+    for i, network in enumerate(networks):
+        for other in networks[:i]:
+            if network in other or other in network:
+                problems.append(f"Subnet {network} overlaps subnet {other}.")
+        conflicts = index.conflicts(network)
+        if conflicts:
+            problems.append(f"Subnet {network} overlaps existing prefixes: {', '.join(conflicts)}.")
+    return problems
+
+
+def lock_pool(pool):
+    """
+    Re-read `pool` with SELECT ... FOR UPDATE. Concurrent allocations from the
+    same pool wait here until the holding transaction ends, so the lock must
+    be taken inside the transaction that creates the allocated prefixes.
+    """
+    if not transaction.get_connection().in_atomic_block:
+        raise RuntimeError("Subnets can only be allocated inside a transaction")
+    return Prefix.objects.select_for_update().get(pk=pool.pk)
+
+
+def validate_allocation_length(pool, length):
+    """Check that child prefixes of `length` fit inside `pool`."""
+    network = pool.prefix
+    max_length = 32 if network.version == 4 else 128
+    if not network.prefixlen <= length <= max_length:
+        raise ValidationError(
+            f"Cannot allocate /{length} subnets from pool {network}: the length must be between "
+            f"{network.prefixlen} and {max_length}."
+        )
+
+
+def allocate_subnets(pool, lengths, reserved=()):
+    """
+    Allocate one free child prefix of `pool` per entry of `lengths`.
 
-class CreateSiteWithSubnetsScript(Script):
+    Free space is computed from the pool's existing children (in any VRF) plus
+    the `reserved` networks, loaded once into a PrefixIndex.
+    """
+    for length in set(lengths):
+        validate_allocation_length(pool, length)
+    pool = lock_pool(pool)
+    index = PrefixIndex.from_queryset(
+        Prefix.objects.filter(prefix__net_contained=str(pool.prefix))
+    )
+    for network in reserved:
+        index.add(network)
+
+    allocated = []
+    for length in lengths:
+        free = index.next_free(pool.prefix, length)
+        if not free:
+            raise ValidationError(f"No free /{length} left in pool {pool.prefix}.")
+        index.add(free[0])
+        allocated.append(free[0])
+    return allocated
+
+
+def read_site_file(upload):
+    """Return the rows of an uploaded CSV or YAML site file as a list of dicts."""
+    content = upload.read()
+    if isinstance(content, bytes):
+        content = content.decode('utf-8-sig')
+
+    if upload.name.lower().endswith(('.yaml', '.yml')):
+        rows = yaml.safe_load(content) or []
+        if not isinstance(rows, list) or not all(isinstance(row, dict) for row in rows):
+            raise ValidationError("The YAML site file must contain a list of site mappings.")
+        return rows
+
+    return list(csv.DictReader(io.StringIO(content)))
+
+
+class CreateSiteWithSubnetsScript(InstrumentedScriptMixin, Script):
     class Meta:
         name = "Create Site with Subnets and VRF"
         description = "Script to create a new site with VRF and assigned subnets"
@@ -24,9 +135,11 @@ class CreateSiteWithSubnetsScript(Script):
                     ]
         fieldsets = (
             ('Site data', ('site_name', 'site_description', 'physical_address')),
-            ('Site networks', ('camera_subnet', 'pos_subnet')),
+            ('Site networks', ('camera_subnet', 'pos_subnet', 'parent_pool',
+                               'allocation_prefix_length', 'allow_overlap')),
             ('Site contact', ('existing_contact', 'contact_role','contact_name',
                               'contact_email', 'contact_phone')),
+            ('Diagnostics', ('cprofile_dump',)),
         )
         commit_default = True
         scheduling_enabled = False
@@ -77,33 +190,82 @@ class CreateSiteWithSubnetsScript(Script):
     
     # Define additional inputs for two subnets
     camera_subnet = StringVar(
-        description="Subnet for cameras (e.g., 192.168.1.0/24) - default prefix is /24 if unspecified",
-        required=True
+        description="Subnet for cameras (e.g., 192.168.1.0/24) - default prefix is /24 if unspecified. "
+                    "Leave blank to allocate from the parent pool",
+        required=False
     )
 
     pos_subnet = StringVar(
-        description="Subnet for POS (e.g., 192.168.2.0/24) - default prefix is /24 if unspecified",
-        required=True
+        description="Subnet for POS (e.g., 192.168.2.0/24) - default prefix is /24 if unspecified. "
+                    "Leave blank to allocate from the parent pool",
+        required=False
+    )
+
+    parent_pool = ObjectVar(
+        description="Container prefix to allocate blank subnets from",
+        model=Prefix,
+        query_params={'status': 'container'},
+        required=False
+    )
+
+    allocation_prefix_length = IntegerVar(
+        description="Prefix length of allocated subnets",
+        default=24,
+        min_value=1,
+        max_value=128
+    )
+
+    allow_overlap = BooleanVar(
+        description="Create the subnets even if they overlap existing prefixes",
+        default=False
     )
 
     def validate_network_prefix(self, prefix):
         """Validate and normalize the network prefix, adding /24 if needed."""
-        try:
-            # Check if the input contains a CIDR prefix
-            if '/' not in prefix:
-                prefix += '/24'  # Automatically add /24 if no prefix is given
-            
-            # Validate the network prefix
-            network = IPNetwork(prefix)  # Will raise an error if invalid
-            return network  # Return the network if it's valid
-        except AddrFormatError:
-            raise ValidationError(f"'{prefix}' is not a valid network prefix.")
+        return validate_network_prefix(prefix)
 
     def run(self, data, commit):
         # Auto-generate slug based on site name
         site_slug=slugify(data['site_name']),
         
         contact_role=data['contact_role']
+
+        # Validate the subnets before creating anything
+        try:
+            networks = [
+                self.validate_network_prefix(data[field_name]) if data.get(field_name) else None
+                for field_name in SUBNET_FIELDS
+            ]
+        except ValidationError as e:
+            self.log_failure(f"Validation error: {e}")
+            raise e
+
+        pool = data.get('parent_pool')
+        if None in networks and not pool:
+            self.log_failure("Enter both subnets or select a parent pool to allocate them from.")
+            return
+
+        given = [network for network in networks if network is not None]
+        if given and not data.get('allow_overlap'):
+            with self.phase('validate'):
+                index = PrefixIndex.from_queryset(related_prefixes(given))
+                problems = find_subnet_conflicts(given, index)
+            if problems:
+                for problem in problems:
+                    self.log_failure(problem)
+                return
+
+        if None in networks:
+            length = data.get('allocation_prefix_length') or 24
+            try:
+                with self.phase('allocate'):
+                    allocated = iter(allocate_subnets(pool, [length] * networks.count(None), reserved=given))
+            except ValidationError as e:
+                self.log_failure(f"Allocation failed: {'; '.join(e.messages)}")
+                return
+            networks = [network if network is not None else next(allocated) for network in networks]
+            self.log_info(f"Allocated subnets from pool {pool.prefix}")
+
         contact = data['existing_contact']
         if not contact:
             # Validate new contact fields if creating a new contact
@@ -118,14 +280,12 @@ class CreateSiteWithSubnetsScript(Script):
             )
             try:
                 contact.full_clean()
-                contact.save()
-                self.log_success(f"Created new contact: {contact.name}")
             except ValidationError as e:
                 self.log_failure(f"Validation error in contact data: {e}")
+                return
         else:
             self.log_info(f"Using existing contact: {contact.name}")
 
-
         # Create the site based on user inputs
         site = Site(
             name=data['site_name'],
@@ -134,8 +294,37 @@ class CreateSiteWithSubnetsScript(Script):
             status=SiteStatusChoices.STATUS_PLANNED,
             physical_address=data.get('physical_address', ''),
         )
-
         site.full_clean()
+
+        plan = ChangePlan()
+        if contact.pk is None:
+            plan.create('contact', samples=[contact.name])
+        plan.create('site', samples=[site.name])
+        plan.create('contact assignment', samples=[f"{contact.name} -> {site.name}"])
+        plan.create('VRF', samples=[f"{site.slug}_vrf"])
+        plan.create(
+            'prefixes',
+            count=len(networks),
+            samples=[f"{network} ({field_name})" for field_name, network in zip(SUBNET_FIELDS, networks)]
+        )
+
+        # Everything above only read from the database
+        if not commit:
+            self.log_info("Dry run, nothing was written")
+            return plan.render() + "\n"
+
+        plan.step(self.create_site, site, contact, contact_role, networks)
+        with self.phase('write'):
+            plan.apply()
+
+        return "Site created\n"
+
+    def create_site(self, site, contact, contact_role, networks):
+        """Save the validated site with its contact, VRF and subnets."""
+        if contact.pk is None:
+            contact.save()
+            self.log_success(f"Created new contact: {contact.name}")
+
         site.save()
         self.log_success(f"Created new site: {site}")
 
@@ -152,34 +341,26 @@ class CreateSiteWithSubnetsScript(Script):
         vrf = VRF(
             name=f"{site.slug}_vrf",
             enforce_unique=False,  # Adjust based on your requirements
-            description = f"VRF for site {data['site_name']}"
+            description = f"VRF for site {site.name}"
         )
         
         vrf.save()
         self.log_success(f"VRF '{vrf.name}' created successfully.")
 
         # Create and assign the subnets to the site and VRF
-        subnet_fields = ['camera_subnet', 'pos_subnet']
         subnets = []
-        try:
-            for i, field_name in enumerate(subnet_fields, start=1):
-                prefix = self.validate_network_prefix(data[field_name])
-                subnet = Prefix(
-                    prefix=prefix,
-                    vrf=vrf,
-                    site=site,
-                    description=f"{field_name.capitalize()} for site {site.name}"
-                    )
+        for field_name, prefix in zip(SUBNET_FIELDS, networks):
+            subnet = Prefix(
+                prefix=prefix,
+                vrf=vrf,
+                site=site,
+                description=f"{field_name.capitalize()} for site {site.name}"
+                )
 
-                subnet.save()
-                self.log_success(f"Subnet {subnet.prefix} created and assigned to site '{site.name}'  as {field_name} in VRF '{vrf.name}'.")
+            subnet.save()
+            self.log_success(f"Subnet {subnet.prefix} created and assigned to site '{site.name}'  as {field_name} in VRF '{vrf.name}'.")
 
-                subnets.append(subnet)
-
-        except ValidationError as e:
-        # Log failure if validation fails
-            self.log_failure(f"Validation error: {e}")
-            raise e
+            subnets.append(subnet)
 
         # Assign the subnets to the site's custom fields
         if len(subnets) == 2:
@@ -189,5 +370,277 @@ class CreateSiteWithSubnetsScript(Script):
             site.save()
             self.log_success("Custom fields 'camera_subnet' and 'pos_subnet' assigned to the site.")
 
-        return "Site created\n"
+        return site
+
+
+class BulkCreateSitesScript(InstrumentedScriptMixin, Script):
+    class Meta:
+        name = "Bulk Create Sites with Subnets and VRFs"
+        description = "Creates many sites, each with a contact, VRF and subnets, from a CSV or YAML file"
+        field_order = ['site_file', 'contact_role', 'parent_pool', 'allocation_prefix_length', 'allow_overlap']
+        commit_default = True
+        scheduling_enabled = False
+
+    site_file = FileVar(
+        description="CSV or YAML file with one site per row. Columns: site_name, site_description, "
+                    "physical_address, contact_name, contact_phone, contact_email, camera_subnet, pos_subnet"
+    )
+
+    contact_role = ObjectVar(
+        description="Contacts person role for all sites",
+        model=ContactRole
+    )
+
+    parent_pool = ObjectVar(
+        description="Container prefix to allocate subnets from for rows that leave them blank",
+        model=Prefix,
+        query_params={'status': 'container'},
+        required=False
+    )
+
+    allocation_prefix_length = IntegerVar(
+        description="Prefix length of allocated subnets",
+        default=24,
+        min_value=1,
+        max_value=128
+    )
+
+    allow_overlap = BooleanVar(
+        description="Create the subnets even if they overlap existing prefixes or subnets of other rows",
+        default=False
+    )
+
+    def validate_rows(self, rows, allow_overlap=False, pool=None, allocation_length=24):
+        """
+        Validate every row up front, in memory and with a fixed number of queries.
+        Returns the valid rows as plans; invalid rows are logged and skipped.
+        """
+        names = [str(row.get('site_name') or '').strip() for row in rows]
+        slugs = [slugify(name) for name in names]
+        existing = set()
+        for name, slug in Site.objects.filter(
+            Q(name__in=names) | Q(slug__in=slugs)
+        ).values_list('name', 'slug'):
+            existing.update((name.lower(), slug))
+        contacts = {
+            contact.name.lower(): contact
+            for contact in Contact.objects.filter(
+                name__in=[row.get('contact_name') for row in rows if row.get('contact_name')]
+            )
+        }
+
+        # Lock the pool before reading prefixes so concurrent runs cannot allocate the same blocks
+        if pool is not None:
+            pool = lock_pool(pool)
+
+        # All existing prefixes are loaded once; accepted subnets are added as we go
+        index = None
+        if pool is not None or not allow_overlap:
+            index = PrefixIndex.from_queryset()
+
+        plans = []
+        seen = set()
+        for number, (row, name, slug) in enumerate(zip(rows, names, slugs), start=1):
+            reserved = []
+            try:
+                if not name:
+                    raise ValidationError("site_name is required.")
+                if name.lower() in seen or slug in seen:
+                    raise ValidationError(f"Site '{name}' appears more than once in the file.")
+                if name.lower() in existing or slug in existing:
+                    raise ValidationError(f"Site '{name}' already exists.")
+
+                site = Site(
+                    name=name,
+                    slug=slug,
+                    description=row.get('site_description') or '',
+                    status=SiteStatusChoices.STATUS_PLANNED,
+                    physical_address=row.get('physical_address') or '',
+                )
+                site.full_clean(validate_unique=False, validate_constraints=False)
+
+                contact_name = (row.get('contact_name') or '').strip()
+                contact = contacts.get(contact_name.lower())
+                if contact is None:
+                    if not contact_name or not row.get('contact_email'):
+                        raise ValidationError("Name and email are required to create a new contact.")
+                    contact = Contact(
+                        name=contact_name,
+                        phone=row.get('contact_phone') or '',
+                        email=row['contact_email'],
+                    )
+                    contact.full_clean(validate_unique=False, validate_constraints=False)
+
+                networks = []
+                for field_name in SUBNET_FIELDS:
+                    if row.get(field_name):
+                        networks.append(validate_network_prefix(str(row[field_name]).strip()))
+                    elif pool is not None:
+                        networks.append(None)
+                    else:
+                        raise ValidationError(f"{field_name} is required.")
+
+                given = [network for network in networks if network is not None]
+                if not allow_overlap:
+                    problems = find_subnet_conflicts(given, index)
+                    if problems:
+                        raise ValidationError(problems)
+                elif len(given) == 2 and (given[0] in given[1] or given[1] in given[0]):
+                    raise ValidationError(
+                        f"Camera subnet {given[0]} and POS subnet {given[1]} overlap."
+                    )
+
+                if None in networks:
+                    # Subnets reserved for this row are released again if a later allocation fails
+                    for network in given:
+                        index.add(network, label=f"{network} (site {name} in this file)")
+                        reserved.append(network)
+                    for position, network in enumerate(networks):
+                        if network is None:
+                            free = index.next_free(pool.prefix, allocation_length)
+                            if not free:
+                                raise ValidationError(f"No free /{allocation_length} left in pool {pool.prefix}.")
+                            networks[position] = free[0]
+                            index.add(free[0], label=f"{free[0]} (site {name} in this file)")
+                            reserved.append(free[0])
+                elif index is not None:
+                    for network in networks:
+                        index.add(network, label=f"{network} (site {name} in this file)")
+
+            except ValidationError as e:
+                for network in reserved:
+                    index.remove(network)
+                self.log_failure(f"Row {number} ({name or 'unnamed'}): {'; '.join(e.messages)}")
+                continue
+
+            seen.update((name.lower(), slug))
+            # Rows naming the same new contact share one Contact
+            contacts[contact.name.lower()] = contact
+            plans.append({'site': site, 'contact': contact, 'networks': networks})
+
+        return plans
+
+    def plan_changes(self, plans):
+        """Describe the objects create_sites() would write for `plans`."""
+        change_plan = ChangePlan()
+        new_contacts = {id(plan['contact']): plan['contact'] for plan in plans if plan['contact'].pk is None}
+        change_plan.create('contacts', count=len(new_contacts),
+                           samples=(contact.name for contact in new_contacts.values()))
+        change_plan.create('sites', count=len(plans), samples=(plan['site'].name for plan in plans))
+        change_plan.create('VRFs', count=len(plans), samples=(f"{plan['site'].slug}_vrf" for plan in plans))
+        change_plan.create(
+            'prefixes',
+            count=sum(len(plan['networks']) for plan in plans),
+            samples=(f"{network} ({plan['site'].name})" for plan in plans for network in plan['networks'])
+        )
+        change_plan.create('contact assignments', count=len(plans))
+        return change_plan
+
+    def create_sites(self, plans, contact_role):
+        """Create all objects of the validated plans with batched inserts."""
+        request = getattr(self, 'request', None)
+
+        with transaction.atomic():
+            new_contacts = list({
+                id(plan['contact']): plan['contact']
+                for plan in plans if plan['contact'].pk is None
+            }.values())
+            if new_contacts:
+                bulk_create_logged(new_contacts, request=request)
+
+            sites = [plan['site'] for plan in plans]
+            site_stats = bulk_create_logged(sites, request=request)
+
+            vrfs = []
+            for plan in plans:
+                site = plan['site']
+                plan['vrf'] = VRF(
+                    name=f"{site.slug}_vrf",
+                    enforce_unique=False,  # Adjust based on your requirements
+                    description=f"VRF for site {site.name}"
+                )
+                vrfs.append(plan['vrf'])
+            bulk_create_logged(vrfs, request=request)
+
+            # Prefixes are saved one by one (two per site) so Prefix.save() and the
+            # IPAM signal handlers maintain _depth and _children of the hierarchy
+            for plan in plans:
+                site = plan['site']
+                plan['prefixes'] = []
+                for field_name, network in zip(SUBNET_FIELDS, plan['networks']):
+                    prefix = Prefix(
+                        prefix=network.cidr,
+                        vrf=plan['vrf'],
+                        site=site,
+                        description=f"{field_name.capitalize()} for site {site.name}"
+                    )
+                    prefix.save()
+                    plan['prefixes'].append(prefix)
+
+            # Assigning the object itself fills the generic FK cache, which the change
+            # records read as their related object
+            bulk_create_logged([
+                ContactAssignment(
+                    object=plan['site'],
+                    contact=plan['contact'],
+                    role=contact_role
+                )
+                for plan in plans
+            ], request=request)
+
+            # Assign the subnets to the sites' custom fields
+            for plan in plans:
+                site = plan['site']
+                site.snapshot()
+                site.custom_field_data['site_camera_network_subnet'] = plan['prefixes'][0].pk
+                site.custom_field_data['site_pos_network_subnet'] = plan['prefixes'][1].pk
+            bulk_update_logged(sites, ['custom_field_data'], request=request)
+
+        return site_stats
+
+    def run(self, data, commit):
+        try:
+            rows = read_site_file(data['site_file'])
+        except (ValidationError, UnicodeDecodeError, csv.Error, yaml.YAMLError) as e:
+            self.log_failure(f"Could not read site file: {e}")
+            return
+
+        pool = data.get('parent_pool')
+        allocation_length = data.get('allocation_prefix_length') or 24
+        if pool is not None:
+            try:
+                validate_allocation_length(pool, allocation_length)
+            except ValidationError as e:
+                self.log_failure('; '.join(e.messages))
+                return
+
+        # Validation and creation share one transaction so a locked pool stays locked until the prefixes exist
+        with transaction.atomic():
+            with self.phase('validate'):
+                plans = self.validate_rows(
+                    rows,
+                    allow_overlap=data.get('allow_overlap'),
+                    pool=pool,
+                    allocation_length=allocation_length
+                )
+            skipped = len(rows) - len(plans)
+            if not plans:
+                self.log_failure(f"No valid sites in file ({skipped} rows skipped).")
+                return
+
+            change_plan = self.plan_changes(plans)
+            if not commit:
+                self.log_info(f"Dry run, nothing was written ({skipped} rows skipped)")
+                return change_plan.render() + "\n"
+
+            change_plan.step(self.create_sites, plans, data['contact_role'])
+            with self.phase('write'):
+                stats, = change_plan.apply()
+        for plan in plans:
+            self.log_success(
+                f"Created site '{plan['site'].name}' with VRF '{plan['vrf'].name}' and subnets "
+                f"{', '.join(str(prefix.prefix) for prefix in plan['prefixes'])}"
+            )
+        self.log_info(f"Sites: {stats}")
 
+        return f"Created {len(plans)} sites, skipped {skipped} rows\n"
@@ -0,0 +1,181 @@
+"""
+Index for matching Tailscale nodes to NetBox devices.
+
+The index answers lookups with dict access, in order of confidence: the
+Tailscale node ID stored in a device custom field, a normalised hostname,
+then any Tailscale IP address assigned to one of the device's interfaces.
+When several devices share a key the lowest device ID wins.
+
+refresh() keeps the index in the Django cache with a cursor into the change
+log (see change_cursor), and only reloads the devices that have device,
+interface or IP address change records after the cursor.
+"""
+import hashlib
+import time
+from bisect import insort
+
+from django.contrib.contenttypes.models import ContentType
+from django.db.models.fields.json import KeyTextTransform
+from dcim.models import Device, Interface
+from ipam.models import IPAddress
+
+from change_cursor import refresh_cached
+
+NODE_ID_FIELD = 'tailscale_node_id'
+
+
+def normalise_hostname(name, strip_suffixes=()):
+    """
+    Lowercase, drop any domain, strip the first matching suffix and treat
+    underscores as dashes.
+    """
+    name = name.strip().lower().split('.')[0]
+    for suffix in strip_suffixes:
+        if suffix and name.endswith(suffix) and len(name) > len(suffix):
+            name = name[:-len(suffix)]
+            break
+    return name.replace('_', '-')
+
+
+def _insert(mapping, key, pk):
+    insort(mapping.setdefault(key, []), pk)
+
+
+def _discard(mapping, key, pk):
+    pks = mapping.get(key)
+    if pks is not None and pk in pks:
+        pks.remove(pk)
+        if not pks:
+            del mapping[key]
+
+
+class DeviceMatchIndex:
+
+    def __init__(self, strip_suffixes=()):
+        self.strip_suffixes = tuple(s.lower() for s in strip_suffixes)
+        self.names = {}
+        # key -> device IDs sharing it, in ascending order
+        self.by_node_id = {}
+        self.by_name = {}
+        self.by_ip = {}
+        # device ID -> (node ID, name key, ((IP address ID, address), ...)) to remove a device again
+        self.keys = {}
+        # IP address ID -> device ID, to find the previous device of a reassigned address
+        self.ip_devices = {}
+        self.cursor = 0
+        self.built_at = time.time()
+
+    @staticmethod
+    def cache_key(scope, strip_suffixes=()):
+        digest = hashlib.sha1(repr((scope, tuple(strip_suffixes))).encode()).hexdigest()
+        return f"tailscale_sync:match_index:v1:{digest}"
+
+    @classmethod
+    def build(cls, devices, strip_suffixes=()):
+        """Build the index from a Device queryset with two projected queries."""
+        index = cls(strip_suffixes)
+        index.load(devices)
+        return index
+
+    def load(self, devices):
+        """Add the devices of a queryset and the IP addresses of their interfaces."""
+        rows = devices.annotate(
+            tailscale_node_id=KeyTextTransform(NODE_ID_FIELD, 'custom_field_data')
+        ).values_list('pk', 'name', 'tailscale_node_id')
+        addresses = {}
+        for ip_id, address, device_id in IPAddress.objects.filter(
+            interface__device__in=devices.values('pk')
+        ).values_list('pk', 'address', 'interface__device_id'):
+            addresses.setdefault(device_id, []).append((ip_id, str(address.ip)))
+        for pk, name, node_id in rows:
+            self.add_device(pk, name, node_id, addresses.get(pk, ()))
+
+    def add_device(self, pk, name, node_id=None, addresses=()):
+        """Add a device with its (IP address ID, address) pairs."""
+        self.names[pk] = name
+        name_key = normalise_hostname(name, self.strip_suffixes) if name else None
+        if node_id:
+            _insert(self.by_node_id, node_id, pk)
+        if name_key:
+            _insert(self.by_name, name_key, pk)
+        for ip_id, address in addresses:
+            _insert(self.by_ip, address, pk)
+            self.ip_devices[ip_id] = pk
+        self.keys[pk] = (node_id, name_key, tuple(addresses))
+
+    def remove_device(self, pk):
+        keys = self.keys.pop(pk, None)
+        if keys is None:
+            return
+        node_id, name_key, addresses = keys
+        del self.names[pk]
+        if node_id:
+            _discard(self.by_node_id, node_id, pk)
+        if name_key:
+            _discard(self.by_name, name_key, pk)
+        for ip_id, address in addresses:
+            _discard(self.by_ip, address, pk)
+            if self.ip_devices.get(ip_id) == pk:
+                del self.ip_devices[ip_id]
+
+    def changed_devices(self, changes):
+        """
+        IDs of devices affected by the device, interface or IP address records
+        in `changes`, an ObjectChange queryset.
+        """
+        device_type = ContentType.objects.get_for_model(Device)
+        device_ids = set(changes.filter(
+            changed_object_type=device_type
+        ).values_list('changed_object_id', flat=True))
+        # Interface changes are recorded with their device as the related object
+        device_ids.update(changes.filter(
+            changed_object_type=ContentType.objects.get_for_model(Interface),
+            related_object_type=device_type
+        ).values_list('related_object_id', flat=True))
+
+        ip_ids = set(changes.filter(
+            changed_object_type=ContentType.objects.get_for_model(IPAddress)
+        ).values_list('changed_object_id', flat=True))
+        if ip_ids:
+            # Both the device an address was on and the one it is on now
+            device_ids.update(self.ip_devices[ip_id] for ip_id in ip_ids if ip_id in self.ip_devices)
+            device_ids.update(IPAddress.objects.filter(
+                pk__in=ip_ids, interface__isnull=False
+            ).values_list('interface__device_id', flat=True))
+        device_ids.discard(None)
+        return device_ids
+
+    def apply(self, device_ids, devices):
+        """Replace the entries of `device_ids` with their current state in `devices`."""
+        for pk in device_ids:
+            self.remove_device(pk)
+        self.load(devices.filter(pk__in=device_ids))
+
+    @classmethod
+    def refresh(cls, devices, strip_suffixes=(), scope=None, rebuild=False):
+        """
+        Return an up to date index of `devices`, applying the changes since
+        the cached cursor or rebuilding it. `scope` identifies the filter
+        `devices` was built with. The second value is the number of devices
+        reloaded, or None after a full rebuild.
+        """
+        return refresh_cached(
+            cls.cache_key(scope, strip_suffixes),
+            build=lambda: cls.build(devices, strip_suffixes),
+            changed=cls.changed_devices,
+            apply=lambda index, device_ids: index.apply(device_ids, devices),
+            rebuild=rebuild
+        )
+
+    def match(self, node):
+        """Return the device ID for a TailscaleNode, or None."""
+        if node.node_id and node.node_id in self.by_node_id:
+            return self.by_node_id[node.node_id][0]
+        pks = self.by_name.get(normalise_hostname(node.hostname, self.strip_suffixes))
+        if pks:
+            return pks[0]
+        for address in node.addresses:
+            pks = self.by_ip.get(address)
+            if pks:
+                return pks[0]
+        return None
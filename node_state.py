@@ -0,0 +1,79 @@
+"""
+Persisted snapshots of Tailscale node state between sync runs.
+
+A snapshot maps node hostnames to their last online/offline verdict. It can be
+kept in NetBox's cache backend or in a local JSON file.
+
+Script forms only take a file name. state_path() places it in the state
+directory configured on the script, so a form cannot point the job at an
+arbitrary path on the NetBox host.
+"""
+import json
+import os
+import re
+import tempfile
+
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+
+# Plain file names only: no directories, no leading dot
+SAFE_NAME = re.compile(r'[A-Za-z0-9][A-Za-z0-9._-]*\Z')
+
+
+def state_path(directory, name):
+    """
+    Return the path of file `name` inside `directory`. Raises
+    ValidationError if no directory is configured or `name` is not a plain
+    file name.
+    """
+    if not directory:
+        raise ValidationError("No state directory is configured for this script, file options are disabled.")
+    if not SAFE_NAME.fullmatch(name):
+        raise ValidationError(
+            f"'{name}' is not a valid file name. Enter a name without directories, "
+            f"the file is kept in the configured state directory."
+        )
+    return os.path.join(directory, name)
+
+
+class CacheNodeStateStore:
+    """Keep the snapshot in the configured Django cache backend."""
+
+    def __init__(self, tailnet):
+        self.key = f"tailscale_sync:node_state:{tailnet}"
+
+    def load(self):
+        return cache.get(self.key)
+
+    def save(self, state):
+        cache.set(self.key, state, timeout=None)
+
+
+class FileNodeStateStore:
+    """Keep the snapshot in a JSON file, replaced atomically on save."""
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def save(self, state):
+        directory = os.path.dirname(os.path.abspath(self.path))
+        fd, tmp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        with os.fdopen(fd, 'w') as f:
+            json.dump(state, f)
+        os.replace(tmp_path, self.path)
+
+
+def diff_node_states(previous, current):
+    """Return the entries of `current` whose verdict differs from `previous`."""
+    return {
+        hostname: is_online
+        for hostname, is_online in current.items()
+        if previous.get(hostname) != is_online
+    }
@@ -0,0 +1,184 @@
+"""
+In-memory index of existing prefixes for overlap checks and free-space search.
+
+Prefixes are stored per IP version as a list sorted by first address, plus a
+dict keyed on (first address, prefix length). CIDR prefixes are either nested
+or disjoint, so a candidate overlaps an existing prefix only if the existing
+one is an ancestor or equal (found with one dict lookup per prefix length) or
+a descendant (found by bisecting the sorted list). Both checks take
+logarithmic time in the number of prefixes.
+
+Ancestors with container status are pools that new subnets are meant to be
+carved from, and are not reported as conflicts.
+
+next_free() remembers, per supernet and block size, the address below which
+no free block is left. Adding prefixes never frees space, so repeated
+allocations from a filling pool resume there instead of re-walking every
+child. remove() frees space and forgets these hints.
+"""
+from bisect import bisect_left, bisect_right
+
+from netaddr import IPAddress, IPNetwork
+
+BITS = {4: 32, 6: 128}
+
+
+def network_bounds(network):
+    return network.version, network.first, network.last, network.prefixlen
+
+
+class PrefixIndex:
+
+    def __init__(self):
+        # version -> sorted list of (first, prefixlen, last, container, label)
+        self._entries = {4: [], 6: []}
+        # version -> list of first addresses, kept aligned with _entries for bisect
+        self._firsts = {4: [], 6: []}
+        # (version, first, prefixlen) -> list of entries for that exact prefix
+        self._exact = {}
+        # (version, supernet first, supernet prefixlen, prefixlen) -> first address
+        # of the search; no free block of that length starts below it
+        self._free_hints = {}
+
+    def __len__(self):
+        return len(self._entries[4]) + len(self._entries[6])
+
+    @classmethod
+    def from_queryset(cls, prefixes=None):
+        """Load prefixes (all of them by default) with one projected query."""
+        from ipam.choices import PrefixStatusChoices
+        from ipam.models import Prefix
+
+        if prefixes is None:
+            prefixes = Prefix.objects.all()
+        entries = []
+        for prefix, status, vrf_name in prefixes.values_list('prefix', 'status', 'vrf__name'):
+            label = f"{prefix} (VRF {vrf_name})" if vrf_name else f"{prefix} (global)"
+            entries.append((prefix, status == PrefixStatusChoices.STATUS_CONTAINER, label))
+        index = cls()
+        index.load(entries)
+        return index
+
+    def load(self, entries):
+        """Bulk-load an iterable of (network, is_container, label) and sort once."""
+        for network, container, label in entries:
+            version, first, last, prefixlen = network_bounds(IPNetwork(network))
+            entry = (first, prefixlen, last, container, label)
+            self._entries[version].append(entry)
+            self._exact.setdefault((version, first, prefixlen), []).append(entry)
+        for version, entries in self._entries.items():
+            entries.sort()
+            self._firsts[version] = [entry[0] for entry in entries]
+
+    def add(self, network, container=False, label=None):
+        """Insert one prefix, e.g. a subnet accepted earlier in the same batch."""
+        network = IPNetwork(network)
+        version, first, last, prefixlen = network_bounds(network)
+        entry = (first, prefixlen, last, container, label or str(network))
+        position = bisect_right(self._entries[version], entry)
+        self._entries[version].insert(position, entry)
+        self._firsts[version].insert(position, first)
+        self._exact.setdefault((version, first, prefixlen), []).append(entry)
+
+    def remove(self, network):
+        """Remove the most recently added entry for exactly `network`."""
+        version, first, last, prefixlen = network_bounds(IPNetwork(network))
+        exact = self._exact.get((version, first, prefixlen))
+        if not exact:
+            raise KeyError(str(network))
+        entry = exact.pop()
+        if not exact:
+            del self._exact[(version, first, prefixlen)]
+        position = bisect_left(self._entries[version], entry)
+        del self._entries[version][position]
+        del self._firsts[version][position]
+        self._free_hints.clear()
+
+    def _ancestors(self, version, first, prefixlen):
+        """Yield entries equal to or containing the given prefix, widest last."""
+        bits = BITS[version]
+        full = (1 << bits) - 1
+        for length in range(prefixlen, -1, -1):
+            network_first = first & (full ^ ((1 << (bits - length)) - 1))
+            yield from self._exact.get((version, network_first, length), ())
+
+    def _descendants(self, version, first, last, prefixlen):
+        """Yield entries strictly inside the given prefix, in address order."""
+        entries = self._entries[version]
+        position = bisect_left(self._firsts[version], first)
+        while position < len(entries) and entries[position][0] <= last:
+            entry = entries[position]
+            if entry[1] > prefixlen:
+                yield entry
+            position += 1
+
+    def iter_conflicts(self, network):
+        """Yield the labels of existing prefixes that collide with `network`."""
+        version, first, last, prefixlen = network_bounds(IPNetwork(network))
+        for entry in self._ancestors(version, first, prefixlen):
+            # Containers are pools to allocate from, not collisions
+            if entry[1] < prefixlen and entry[3]:
+                continue
+            yield entry[4]
+        for entry in self._descendants(version, first, last, prefixlen):
+            yield entry[4]
+
+    def conflicts(self, network, limit=10):
+        """Return up to `limit` labels of prefixes colliding with `network`."""
+        found = []
+        for label in self.iter_conflicts(network):
+            found.append(label)
+            if len(found) >= limit:
+                break
+        return found
+
+    def overlaps(self, network):
+        return next(self.iter_conflicts(network), None) is not None
+
+    def next_free(self, supernet, prefixlen, count=1):
+        """
+        Return up to `count` free, aligned child prefixes of length `prefixlen`
+        inside `supernet`. Walks the gaps between the supernet's existing
+        children in address order, starting where the previous search for the
+        same block size found its first free block, so the cost grows with
+        the children walked past rather than with all children of the pool.
+        """
+        supernet = IPNetwork(supernet)
+        version, first, last, parent_len = network_bounds(supernet)
+        if prefixlen < parent_len or prefixlen > BITS[version]:
+            raise ValueError(f"Cannot allocate a /{prefixlen} inside {supernet}")
+        size = 1 << (BITS[version] - prefixlen)
+        hint_key = (version, first, parent_len, prefixlen)
+        cursor = self._free_hints.get(hint_key, first)
+        if cursor > last:
+            return []
+
+        # Children starting before the cursor can only reach past it by containing it
+        for entry in self._ancestors(version, cursor, BITS[version]):
+            if entry[1] > parent_len:
+                cursor = max(cursor, entry[2] + 1)
+
+        free = []
+
+        def take(gap_end):
+            start = -(-cursor // size) * size  # align up to the block size
+            while start + size - 1 <= gap_end and len(free) < count:
+                free.append(IPNetwork(f"{IPAddress(start, version)}/{prefixlen}"))
+                start += size
+
+        entries = self._entries[version]
+        position = bisect_left(self._firsts[version], cursor)
+        while position < len(entries) and entries[position][0] <= last and len(free) < count:
+            child_first, child_len, child_last = entries[position][:3]
+            position += 1
+            if child_len <= parent_len:
+                continue
+            if child_first > cursor:
+                take(child_first - 1)
+            cursor = max(cursor, child_last + 1)
+        if cursor <= last and len(free) < count:
+            take(last)
+
+        # Nothing below the first block found (or the end of the supernet) is free
+        self._free_hints[hint_key] = free[0].first if free else last + 1
+        return free
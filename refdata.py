@@ -0,0 +1,138 @@
+"""
+Cached lookups of reference objects by name.
+
+The scripts filter on a handful of fixed objects (the server role, the
+Tailscale and Cartwatch tags, the storage site). resolve_id() turns a lookup
+into a primary key once and keeps it in the Django cache for DEFAULT_TTL
+seconds, so frequently scheduled jobs can filter by ID without a name join
+or a lookup query on every run. Within a process the IDs are also memoized.
+
+Saving or deleting an object of a cached model bumps that model's generation
+number, which invalidates all of its entries. The signal handlers only run in
+processes that have imported this module (the script workers), so changes
+made elsewhere are picked up once the TTL expires.
+"""
+import hashlib
+import threading
+import time
+
+from django.core.cache import cache
+from django.db.models.signals import post_delete, post_save
+from dcim.models import DeviceRole, Site
+from extras.models import Tag
+
+DEFAULT_TTL = 300
+
+_lock = threading.Lock()
+# (model label, generation, lookup) -> (expiry, pk)
+_local = {}
+_watched = set()
+
+
+def _generation_key(model):
+    return f"refdata:{model._meta.label_lower}:generation"
+
+
+def _generation(model):
+    return cache.get_or_set(_generation_key(model), 0, timeout=None)
+
+
+def _invalidate(sender, **kwargs):
+    try:
+        cache.incr(_generation_key(sender))
+    except ValueError:
+        cache.set(_generation_key(sender), 1, timeout=None)
+    label = sender._meta.label_lower
+    with _lock:
+        for key in [key for key in _local if key[0] == label]:
+            del _local[key]
+
+
+def _watch(model):
+    if model in _watched:
+        return
+    uid = f"refdata:{model._meta.label_lower}"
+    post_save.connect(_invalidate, sender=model, weak=False, dispatch_uid=f"{uid}:save")
+    post_delete.connect(_invalidate, sender=model, weak=False, dispatch_uid=f"{uid}:delete")
+    _watched.add(model)
+
+
+def _cached_id(model, lookup, fetch, ttl):
+    """Return fetch() for `lookup`, a tuple of (key, value) pairs, through both caches."""
+    _watch(model)
+    label = model._meta.label_lower
+    key = (label, _generation(model), lookup)
+    now = time.monotonic()
+    with _lock:
+        entry = _local.get(key)
+    if entry is not None and entry[0] > now:
+        return entry[1]
+
+    # Hash the lookup, names may contain characters some cache backends reject in keys
+    cache_key = f"refdata:{label}:{key[1]}:{hashlib.sha1(repr(lookup).encode()).hexdigest()}"
+    pk = cache.get(cache_key)
+    if pk is None:
+        pk = fetch()
+        cache.set(cache_key, pk, timeout=ttl)
+    with _lock:
+        _local[key] = (now + ttl, pk)
+    return pk
+
+
+def resolve_id(model, ttl=DEFAULT_TTL, **lookup):
+    """
+    Return the primary key of the single `model` object matching `lookup`.
+    Raises model.DoesNotExist if there is none and
+    model.MultipleObjectsReturned if the lookup is ambiguous.
+    """
+    lookup = tuple(sorted(lookup.items()))
+    description = ", ".join(f"{k}={v!r}" for k, v in lookup)
+
+    def fetch():
+        try:
+            return model.objects.values_list('pk', flat=True).get(**dict(lookup))
+        except model.DoesNotExist:
+            raise model.DoesNotExist(f"No {model._meta.verbose_name} matching {description}")
+        except model.MultipleObjectsReturned:
+            raise model.MultipleObjectsReturned(
+                f"More than one {model._meta.verbose_name} matches {description}"
+            )
+
+    return _cached_id(model, lookup, fetch, ttl)
+
+
+def clear():
+    """Drop the process-local entries, e.g. between benchmark runs."""
+    with _lock:
+        _local.clear()
+
+
+def device_role_id(name, ttl=DEFAULT_TTL):
+    """
+    The scripts disagree on 'server' vs 'Server', so roles are matched
+    ignoring case in one query. An exact match wins; otherwise the match
+    must be unique. The result is cached under the name asked for.
+    """
+    def fetch():
+        roles = list(DeviceRole.objects.filter(name__iexact=name).values_list('pk', 'name'))
+        for pk, role_name in roles:
+            if role_name == name:
+                return pk
+        if not roles:
+            raise DeviceRole.DoesNotExist(f"No device role named {name!r}")
+        if len(roles) > 1:
+            raise DeviceRole.MultipleObjectsReturned(
+                f"More than one device role is named {name!r} ignoring case: "
+                + ", ".join(sorted(role_name for _, role_name in roles))
+            )
+        return roles[0][0]
+
+    return _cached_id(DeviceRole, (('role_name', name),), fetch, ttl)
+
+
+def tag_id(name):
+    return resolve_id(Tag, name=name)
+
+
+def site_id(name):
+    return resolve_id(Site, name=name)
@@ -0,0 +1,75 @@
+"""
+Set-based device relocation used by the site retirement scripts.
+
+Devices are loaded once, changed in memory and written back with batched
+bulk updates and bulk change logging inside one transaction. Cached site
+references on the devices' cable terminations are corrected with a single
+UPDATE.
+"""
+import time
+from dataclasses import dataclass
+
+from django.db import transaction
+from dcim.models import CableTermination, Device
+
+from bulk import DEFAULT_BATCH_SIZE, bulk_update_logged
+
+
+@dataclass
+class RelocationStats:
+    devices: int = 0
+    child_devices: int = 0
+    cable_terminations: int = 0
+    batches: int = 0
+    elapsed: float = 0.0
+
+    def __str__(self):
+        return (
+            f"{self.devices} devices, {self.child_devices} child devices and "
+            f"{self.cable_terminations} cable terminations in {self.batches} batches "
+            f"in {self.elapsed:.2f}s"
+        )
+
+
+def relocate_devices(devices, site, status=None, request=None, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Move the devices of the `devices` queryset to `site`, optionally setting
+    `status`. Rack, location and position are cleared because they belong to
+    the old site. Devices installed in their device bays follow their parent.
+    """
+    stats = RelocationStats()
+    start = time.monotonic()
+
+    with transaction.atomic():
+        # Snapshots and change records serialize the tags, prefetch them instead of a query per device
+        moved = list(devices.select_for_update().prefetch_related('tags'))
+        device_ids = [device.pk for device in moved]
+        children = list(
+            Device.objects.filter(
+                parent_bay__device_id__in=device_ids
+            ).exclude(pk__in=device_ids).prefetch_related('tags')
+        )
+
+        for device in moved + children:
+            device.snapshot()
+            device.site = site
+            device.location = None
+            device.rack = None
+            device.position = None
+            device.face = ''
+        if status is not None:
+            for device in moved:
+                device.status = status
+
+        fields = ['site', 'location', 'rack', 'position', 'face', 'status']
+        write_stats = bulk_update_logged(moved + children, fields, request=request, batch_size=batch_size)
+
+        stats.cable_terminations = CableTermination.objects.filter(
+            _device_id__in=device_ids + [child.pk for child in children]
+        ).update(_site=site, _location=None, _rack=None)
+
+    stats.devices = len(moved)
+    stats.child_devices = len(children)
+    stats.batches = write_stats.batches
+    stats.elapsed = time.monotonic() - start
+    return stats
@@ -0,0 +1,152 @@
+"""
+Single-pass renderers for tabular script reports.
+
+A report is a stream of row tuples. render_rows() feeds each row to every
+renderer once, and each renderer appends to its own in-memory buffer. This
+avoids building the same table twice and avoids the quadratic copying of
+repeated string concatenation.
+"""
+import csv
+import io
+import json
+from html import escape
+
+
+class Column:
+    def __init__(self, key, header):
+        self.key = key
+        self.header = header
+
+
+class RowRenderer:
+    """Base renderer writing to a buffered text stream."""
+
+    def __init__(self, columns):
+        self.columns = columns
+        self.buffer = io.StringIO()
+
+    def begin(self):
+        pass
+
+    def row(self, values):
+        raise NotImplementedError
+
+    def end(self):
+        pass
+
+    def getvalue(self):
+        return self.buffer.getvalue()
+
+
+class HTMLTableRenderer(RowRenderer):
+    """Render rows as an HTML table, usable as Confluence storage format."""
+
+    def begin(self):
+        write = self.buffer.write
+        write('<table class="table"><thead><tr>')
+        for column in self.columns:
+            write(f'<th>{escape(column.header)}</th>')
+        write('</tr></thead><tbody>')
+
+    def row(self, values):
+        write = self.buffer.write
+        write('<tr>')
+        for value in values:
+            write(f'<td>{escape(str(value))}</td>')
+        write('</tr>')
+
+    def end(self):
+        self.buffer.write('</tbody></table>')
+
+
+class TextRenderer(RowRenderer):
+    """Render one line per row from a str.format() template using the column keys."""
+
+    def __init__(self, columns, template):
+        super().__init__(columns)
+        self.template = template
+        self.keys = [column.key for column in columns]
+        self.rows = 0
+
+    def row(self, values):
+        if self.rows:
+            self.buffer.write('\n')
+        self.buffer.write(self.template.format(**dict(zip(self.keys, values))))
+        self.rows += 1
+
+
+class CSVRenderer(RowRenderer):
+
+    def __init__(self, columns):
+        super().__init__(columns)
+        self.writer = csv.writer(self.buffer)
+
+    def begin(self):
+        self.writer.writerow([column.header for column in self.columns])
+
+    def row(self, values):
+        self.writer.writerow(values)
+
+
+class JSONRenderer(RowRenderer):
+    """Render rows as a JSON array of objects keyed by column key."""
+
+    def __init__(self, columns):
+        super().__init__(columns)
+        self.keys = [column.key for column in columns]
+        self.rows = 0
+
+    def begin(self):
+        self.buffer.write('[')
+
+    def row(self, values):
+        if self.rows:
+            self.buffer.write(',')
+        self.buffer.write(json.dumps(dict(zip(self.keys, values))))
+        self.rows += 1
+
+    def end(self):
+        self.buffer.write(']')
+
+
+class ShardedRenderer(RowRenderer):
+    """
+    Split rows into one renderer per distinct value of the `shard_by` column,
+    e.g. one HTML table per site. Shards are created by `factory(columns)`.
+    """
+
+    def __init__(self, columns, shard_by, factory):
+        super().__init__(columns)
+        self.index = [column.key for column in columns].index(shard_by)
+        self.factory = factory
+        self.shards = {}
+
+    def row(self, values):
+        key = values[self.index]
+        shard = self.shards.get(key)
+        if shard is None:
+            shard = self.shards[key] = self.factory(self.columns)
+            shard.begin()
+        shard.row(values)
+
+    def end(self):
+        for shard in self.shards.values():
+            shard.end()
+
+    def getvalue(self):
+        """Return {shard key: rendered shard}."""
+        return {key: shard.getvalue() for key, shard in self.shards.items()}
+
+
+def render_rows(rows, renderers):
+    """Feed every row of `rows` to all `renderers` in a single pass. Returns the row count."""
+    for renderer in renderers:
+        renderer.begin()
+    count = 0
+    for values in rows:
+        for renderer in renderers:
+            renderer.row(values)
+        count += 1
+    for renderer in renderers:
+        renderer.end()
+    return count
@@ -1,14 +1,135 @@
-from dcim.models import Site, Device, Rack, DeviceRole
-from ipam.models import IPAddress, Prefix
-from extras.scripts import Script, ObjectVar, BooleanVar
+import contextvars
+import time
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, as_completed
+
+from dcim.models import Site, Device, DeviceRole, Region
+from extras.scripts import Script, ObjectVar, MultiObjectVar, BooleanVar, IntegerVar
 from django.core.exceptions import ValidationError
+from django.db import close_old_connections, connection, transaction
 from dcim.choices import DeviceStatusChoices, SiteStatusChoices
 
+from changeplan import ChangePlan
+from deletion_planner import DEFAULT_CHUNK_SIZE, SiteDeletionPlan
+from instrumentation import InstrumentedScriptMixin
+from refdata import device_role_id, site_id
+from relocation import relocate_devices
+
+# Predefined storage site name
+STORAGE_SITE_NAME = "Storage Site"
+DEVICE_ROLE_NAME = "Server"  # Replace with the role name you want to filter by
+
+
+def get_storage_site_and_role(storage_site_name=STORAGE_SITE_NAME, device_role_name=DEVICE_ROLE_NAME):
+    """Return the storage site and the ID of the device role to move."""
+    # Retrieve the predefined storage site
+    try:
+        storage_site = Site.objects.get(pk=site_id(storage_site_name))
+    except Site.DoesNotExist:
+        raise ValidationError(f"Storage site '{storage_site_name}' does not exist. Please check the site name.")
+
+    try:
+        device_role = device_role_id(device_role_name)
+    except DeviceRole.DoesNotExist:
+        raise ValidationError(f"Device role '{device_role_name}' does not exist. Please check the role name.")
+    except DeviceRole.MultipleObjectsReturned:
+        raise ValidationError(
+            f"More than one device role is named '{device_role_name}' (ignoring case). Please check the role name."
+        )
+
+    return storage_site, device_role
+
+
+class SiteResult:
+    """Outcome of decommissioning one site."""
+
+    def __init__(self, site):
+        self.site = site
+        self.relocation = None
+        self.planned_deletions = []
+        self.deleted = None
+        self.elapsed = 0.0
+
+    @property
+    def devices_moved(self):
+        return self.relocation.devices if self.relocation else 0
+
+    @property
+    def rows_deleted(self):
+        return sum(self.deleted.values()) if self.deleted else 0
+
+
+def _untimed(name):
+    return nullcontext()
+
+
+def plan_decommission(plan, site, storage_site, device_role, delete_site):
+    """Record in `plan` what decommission_site() would change for `site`."""
+    devices = Device.objects.filter(site=site, role_id=device_role)
+    plan.update(
+        'devices',
+        count=devices.count(),
+        samples=devices.order_by('name').values_list('name', flat=True)[:plan.sample_size],
+        changes={
+            'site': (None, storage_site.name),
+            'status': (None, DeviceStatusChoices.STATUS_DECOMMISSIONING),
+        }
+    )
+    plan.update(
+        'sites',
+        samples=[site.name],
+        changes={'status': (None, SiteStatusChoices.STATUS_DECOMMISSIONING)}
+    )
+    if delete_site:
+        # Everything attached to the site, except the devices that are moved away first
+        for label, count in SiteDeletionPlan(site, keep_devices=devices).counts():
+            plan.delete(label, count=count)
+    return plan
+
+
+def decommission_site(site, storage_site, device_role, delete_site, request=None,
+                      chunk_size=DEFAULT_CHUNK_SIZE, phase=None):
+    """
+    Move the site's devices with the role ID `device_role` to `storage_site`, mark the site
+    as decommissioning and optionally delete it with everything attached. `phase`, if given,
+    is a context manager factory timing the 'relocate' and 'delete' phases.
+    """
+    if phase is None:
+        phase = _untimed
+    result = SiteResult(site)
+    start = time.monotonic()
+
+    # Get all devices from the site to be decommissioned
+    devices_to_move = Device.objects.filter(site=site, role_id=device_role)
+    if devices_to_move.exists():
+        with phase('relocate'):
+            result.relocation = relocate_devices(
+                devices_to_move,
+                storage_site,
+                status=DeviceStatusChoices.STATUS_DECOMMISSIONING,
+                request=request
+            )
+
+    # Update the site status to Decommissioning
+    site.status = SiteStatusChoices.STATUS_DECOMMISSIONING
+    site.save()
+
+    # If requested, delete the site and related items
+    if delete_site:
+        plan = SiteDeletionPlan(site)
+        result.planned_deletions = [(label, count) for label, count in plan.counts() if count]
+        with phase('delete'):
+            result.deleted = plan.execute(chunk_size=chunk_size)
+
+    result.elapsed = time.monotonic() - start
+    return result
 
-class MoveDevicesAndDecommissionSite(Script):
+
+class MoveDevicesAndDecommissionSite(InstrumentedScriptMixin, Script):
     class Meta:
         name = "Move Devices and Decommission Site"
         description = "Moves all devices from a selected site to a predefined storage site, changes the site status to Decommissioning, and optionally deletes the site and related items."
+        scheduling_enabled = False
 
     # Prompt to select the site to be decommissioned
     decommission_site = ObjectVar(
@@ -21,75 +142,163 @@ class MoveDevicesAndDecommissionSite(Script):
         description="Delete the site and all related items (racks, IP addresses, etc.) after moving devices."
     )
 
-    # Predefined storage site name
-    STORAGE_SITE_NAME = "Storage Site"
-    DEVICE_ROLE_NAME = "Server"  # Replace with the role name you want to filter by
-
-    scheduling_enabled = False
-
+    STORAGE_SITE_NAME = STORAGE_SITE_NAME
+    DEVICE_ROLE_NAME = DEVICE_ROLE_NAME
+    DELETE_CHUNK_SIZE = DEFAULT_CHUNK_SIZE
 
     def run(self, data, commit):
-        decommission_site = data['decommission_site']
+        site = data['decommission_site']
         delete_site = data['delete_site']
 
-        # Retrieve the predefined storage site
-        try:
-            storage_site = Site.objects.get(name=self.STORAGE_SITE_NAME)
-        except Site.DoesNotExist:
-            raise ValidationError(f"Storage site '{self.STORAGE_SITE_NAME}' does not exist. Please check the site name.")
+        storage_site, device_role = get_storage_site_and_role(self.STORAGE_SITE_NAME, self.DEVICE_ROLE_NAME)
 
         # Validation: Ensure storage site and decommission site are not the same
-        if decommission_site == storage_site:
+        if site == storage_site:
             raise ValidationError("The decommission site and storage site must be different.")
 
-        try:
-            device_role = DeviceRole.objects.get(name=self.DEVICE_ROLE_NAME)
-        except DeviceRole.DoesNotExist:
-            raise ValidationError(f"Device role '{self.DEVICE_ROLE_NAME}' does not exist. Please check the role name.")
+        plan = plan_decommission(ChangePlan(), site, storage_site, device_role, delete_site)
+
+        # Everything above only read from the database
+        if not commit:
+            self.log_info("Dry run, nothing was written")
+            return plan.render() + "\n"
 
-        # Get all devices from the site to be decommissioned
-        devices_to_move = Device.objects.filter(site=decommission_site,role=device_role)
+        plan.step(
+            decommission_site, site, storage_site, device_role, delete_site,
+            request=getattr(self, 'request', None),
+            chunk_size=self.DELETE_CHUNK_SIZE,
+            phase=self.phase
+        )
+        result, = plan.apply()
 
-        if not devices_to_move.exists():
-            self.log_info(f"No devices found at site '{decommission_site.name}'. Nothing to move.")
+        # Summary of the operation
+        if result.relocation is None:
+            self.log_info(f"No devices found at site '{site.name}'. Nothing to move.")
         else:
-            # Move each device to the storage site
-            for device in devices_to_move:
-                device.site = storage_site
-                device.status = DeviceStatusChoices.STATUS_DECOMMISSIONING
-                device.save()  # Commit the change to the database
-                self.log_success(f"Moved device '{device.name}' from '{decommission_site.name}' to '{storage_site.name}'.")
+            self.log_success(
+                f"Moved devices from '{site.name}' to '{storage_site.name}': {result.relocation}."
+            )
+        self.log_success(f"Updated site status of '{site.name}' to 'Decommissioning'.")
+        if result.deleted is not None:
+            self.log_success(
+                f"Deleted site '{site.name}' and related objects "
+                f"({result.rows_deleted} rows including cascades) in {result.elapsed:.2f}s: "
+                + ", ".join(f"{count} {label}" for label, count in result.planned_deletions)
+            )
+
+
+class DecommissionMultipleSites(InstrumentedScriptMixin, Script):
+    class Meta:
+        name = "Decommission Multiple Sites"
+        description = "Moves the devices of many sites to the storage site and decommissions the sites concurrently, optionally deleting them."
+        scheduling_enabled = False
+
+    sites = MultiObjectVar(
+        model=Site,
+        description="Sites to decommission",
+        required=False
+    )
+
+    region = ObjectVar(
+        model=Region,
+        description="Also decommission every site in this region and its child regions",
+        required=False
+    )
 
-            # Summary of the move operation
-            self.log_info(f"Successfully moved {devices_to_move.count()} devices from '{decommission_site.name}' to '{storage_site.name}'.")
+    delete_site = BooleanVar(
+        description="Delete each site and all related items (racks, IP addresses, etc.) after moving devices."
+    )
 
-        # Update the site status to Decommissioning
+    max_workers = IntegerVar(
+        description="Number of sites processed in parallel",
+        default=4,
+        min_value=1,
+        max_value=16
+    )
+
+    STORAGE_SITE_NAME = STORAGE_SITE_NAME
+    DEVICE_ROLE_NAME = DEVICE_ROLE_NAME
+    DELETE_CHUNK_SIZE = DEFAULT_CHUNK_SIZE
+
+    def get_sites(self, data):
+        site_ids = {site.pk for site in data.get('sites') or []}
+        if data.get('region'):
+            site_ids.update(
+                Site.objects.filter(
+                    region__in=data['region'].get_descendants(include_self=True)
+                ).values_list('pk', flat=True)
+            )
+        return Site.objects.filter(pk__in=site_ids).order_by('name')
+
+    def process_site(self, site_pk, storage_site, device_role, delete_site):
+        """Decommission one site in its own transaction on this worker thread's connection."""
+        close_old_connections()
         try:
+            site = Site.objects.get(pk=site_pk)
+            with transaction.atomic():
+                return decommission_site(
+                    site, storage_site, device_role, delete_site,
+                    request=getattr(self, 'request', None),
+                    chunk_size=self.DELETE_CHUNK_SIZE,
+                    phase=self.phase
+                )
+        finally:
+            connection.close()
 
-            decommission_site.status = SiteStatusChoices.STATUS_DECOMMISSIONING
-            decommission_site.save()
-            self.log_success(f"Updated site status of '{decommission_site.name}' to 'Decommissioning'.")
+    def run(self, data, commit):
+        storage_site, device_role = get_storage_site_and_role(self.STORAGE_SITE_NAME, self.DEVICE_ROLE_NAME)
+        sites = list(self.get_sites(data).exclude(pk=storage_site.pk))
+        if not sites:
+            self.log_warning("No sites selected.")
+            return
 
-        except ValidationError as e:
-            self.log_failure(str(e))
-            raise e
+        delete_site = data['delete_site']
 
-        # If the delete_site option is selected, delete the site and related items
-        if delete_site:
-            # Cascade delete related items
-            racks_to_delete = Rack.objects.filter(site=decommission_site)
-            devices_to_delete = Device.objects.filter(site=decommission_site)
-            ip_prefixes_to_delete = Prefix.objects.filter(site=decommission_site)
+        # Worker threads commit their own transactions, which the job cannot roll back,
+        # so a dry run only reports what would happen
+        if not commit:
+            plan = ChangePlan()
+            for site in sites:
+                plan_decommission(plan, site, storage_site, device_role, delete_site)
+            self.log_info(f"Dry run for {len(sites)} sites, nothing was written")
+            return plan.render() + "\n"
 
-            racks_deleted = racks_to_delete.count()
-            ip_prefixes_deleted = ip_prefixes_to_delete.count()
-            devices_deleted = devices_to_delete.count()
+        start = time.monotonic()
+        done = 0
+        failed = 0
+        devices_moved = 0
+        rows_deleted = 0
 
+        with ThreadPoolExecutor(max_workers=data.get('max_workers') or 4) as executor:
+            # Each task runs in a copy of the current context so change logging
+            # still attributes the changes to this job's request
+            futures = {
+                executor.submit(
+                    contextvars.copy_context().run,
+                    self.process_site, site.pk, storage_site, device_role, delete_site
+                ): site
+                for site in sites
+            }
+            for future in as_completed(futures):
+                site = futures[future]
+                done += 1
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failed += 1
+                    self.log_failure(f"[{done}/{len(sites)}] Failed to decommission '{site.name}': {e}")
+                    continue
 
-            racks_to_delete.delete()
-            devices_to_delete.delete()
-            ip_prefixes_to_delete.delete() 
-            decommission_site.delete()
+                devices_moved += result.devices_moved
+                rows_deleted += result.rows_deleted
+                self.log_success(
+                    f"[{done}/{len(sites)}] '{site.name}': moved {result.devices_moved} devices, "
+                    f"deleted {result.rows_deleted} rows in {result.elapsed:.2f}s "
+                    f"({time.monotonic() - start:.1f}s elapsed)"
+                )
 
-            # Log deletion summary
-            self.log_success(f"Deleted site '{decommission_site.name}', {racks_deleted} racks,  {ip_prefixes_deleted} IP addresses, { devices_deleted} devices")
+        self.log_info(
+            f"Decommissioned {done - failed} of {len(sites)} sites ({failed} failed): "
+            f"{devices_moved} devices moved, {rows_deleted} rows deleted "
+            f"in {time.monotonic() - start:.2f}s"
+        )
@@ -1,96 +1,385 @@
-from extras.scripts import Script, StringVar
+from extras.scripts import Script, StringVar, BooleanVar, IntegerVar
 from dcim.models import Device
 from dcim.choices import DeviceStatusChoices
 from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MultipleObjectsReturned, ObjectDoesNotExist, ValidationError
+from django.db import transaction
 import requests
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timezone
 
-class TailscaleStatusSync(Script):
+from bulk import bulk_update_logged
+from changeplan import ChangePlan
+from instrumentation import InstrumentedScriptMixin
+from liveness import LivenessLog
+from node_matching import DeviceMatchIndex, normalise_hostname
+from node_state import CacheNodeStateStore, FileNodeStateStore, diff_node_states, state_path
+from refdata import device_role_id, tag_id
+from tailscale_api import Prefetcher, TailscaleClient
+
+class TailscaleStatusSync(InstrumentedScriptMixin, Script):
     class Meta:
         name = "Tailscale Status Sync"
         description = "Syncs device status with Tailscale node online status"
 
+    # Tailscale API base URL, None for the public API
+    API_URL = None
+
+    # Directory for the state files named in the form, None to disable them
+    STATE_DIR = None
+
     tailscale_api_key = StringVar(
         description="Tailscale API Key",
         required=True
     )
 
+    bulk_mode = BooleanVar(
+        description="Write status and last-sync changes with batched bulk updates instead of saving each device",
+        default=False
+    )
+
+    incremental = BooleanVar(
+        description="Only touch devices whose Tailscale online/offline verdict changed since the last run",
+        default=False
+    )
+
+    state_file = StringVar(
+        description="File name in the state directory for the incremental node snapshot (leave blank to use the NetBox cache)",
+        required=False
+    )
+
+    strip_suffixes = StringVar(
+        description="Comma-separated hostname suffixes ignored when matching nodes to devices (e.g. -old,-prod)",
+        required=False
+    )
+
+    liveness_file = StringVar(
+        description="File name in the state directory of the liveness log that online/offline transitions are appended to (leave blank to disable)",
+        required=False
+    )
+
+    stamp_last_sync = BooleanVar(
+        description="Also write the sync time to the tailscale_last_sync custom field of every device",
+        default=False
+    )
+
+    def get_devices(self, device_ids=None):
+        """Devices in scope for the sync, optionally limited to the given IDs."""
+        devices = Device.objects.filter(
+            tags=tag_id('tailscale'),
+            role_id=device_role_id('server'),
+            status__in=[
+                DeviceStatusChoices.STATUS_ACTIVE,
+                DeviceStatusChoices.STATUS_PLANNED,
+                DeviceStatusChoices.STATUS_OFFLINE,
+            ]
+        )
+        if device_ids is not None:
+            devices = devices.filter(pk__in=device_ids)
+        return devices
+
+    def plan_status_changes(self, device_status, device_ids=None, stamp_last_sync=False):
+        """Plan the changes of a sync from a read-only scan of the devices in scope."""
+        plan = ChangePlan()
+        missing = 0
+        devices = self.get_devices(device_ids).order_by('name').values_list('pk', 'name', 'status')
+        for pk, name, status in devices.iterator():
+            if pk not in device_status:
+                missing += 1
+                continue
+            new_status = (
+                DeviceStatusChoices.STATUS_ACTIVE if device_status[pk]
+                else DeviceStatusChoices.STATUS_OFFLINE
+            )
+            if status != new_status:
+                plan.update('devices', samples=[name], changes={'status': (status, new_status)})
+        if missing:
+            self.log_warning(f"{missing} devices not found in Tailscale nodes")
+
+        if stamp_last_sync:
+            devices = Device.objects.filter(tags=tag_id('tailscale'))
+            if device_ids is not None:
+                devices = devices.filter(pk__in=device_ids)
+            plan.update('devices', count=devices.count(), changes={'tailscale_last_sync': (None, 'now')})
+        return plan
+
+    def bulk_sync(self, device_status, device_ids=None, stamp_last_sync=False):
+        """Compute status and custom field changes in memory and write them in batches."""
+        sync_time = datetime.now().isoformat()
+        scope = set(self.get_devices(device_ids).values_list('pk', flat=True))
+        if stamp_last_sync:
+            devices = Device.objects.filter(tags=tag_id('tailscale'))
+            if device_ids is not None:
+                devices = devices.filter(pk__in=scope)
+        else:
+            devices = Device.objects.filter(pk__in=scope)
+        # Change records serialize the tags, prefetch them instead of a query per device
+        devices = devices.prefetch_related('tags')
+
+        changed = []
+        status_changes = 0
+        for device in devices:
+            new_status = None
+            if device.pk in scope:
+                if device.pk in device_status:
+                    new_status = (
+                        DeviceStatusChoices.STATUS_ACTIVE if device_status[device.pk]
+                        else DeviceStatusChoices.STATUS_OFFLINE
+                    )
+                    if device.status == new_status:
+                        new_status = None
+                else:
+                    self.log_warning(
+                        f"Device {device.name} not found in Tailscale nodes"
+                    )
+            if new_status is None and not stamp_last_sync:
+                continue
+
+            # Only devices that are about to change need a pre-change snapshot
+            device.snapshot()
+            if new_status is not None:
+                self.log_info(
+                    f"Updating {device.name} status from "
+                    f"{device.status} to {new_status}"
+                )
+                device.status = new_status
+                status_changes += 1
+            if stamp_last_sync:
+                device.custom_field_data['tailscale_last_sync'] = sync_time
+            changed.append(device)
+
+        stats = bulk_update_logged(
+            changed,
+            ['status', 'custom_field_data'] if stamp_last_sync else ['status'],
+            request=getattr(self, 'request', None)
+        )
+        self.log_success(f"Updated status of {status_changes} devices")
+        self.log_info(f"Bulk write: {stats}")
+
+    def sync(self, device_status, device_ids=None, stamp_last_sync=False):
+        """Save each changed device individually."""
+        devices_updated = 0
+        for device in self.get_devices(device_ids):
+            if device.pk in device_status:
+                is_online = device_status[device.pk]
+                #self.log_debug(f"NetBox device {device.name} is online: {is_online} - netbox: {device.status}")
+                new_status = (
+                    DeviceStatusChoices.STATUS_ACTIVE if is_online
+                    else DeviceStatusChoices.STATUS_OFFLINE
+                )
+
+                if device.status != new_status:
+                    old_status = device.status
+                    device.status = new_status
+                    device.save()
+                    devices_updated += 1
+                    self.log_success(
+                        f"Updated {device.name} status from "
+                        f"{old_status} to {new_status}"
+                    )
+            else:
+                self.log_warning(
+                    f"Device {device.name} not found in Tailscale nodes"
+                )
+
+        self.log_success(f"Updated {devices_updated} devices")
+
+        # Update custom field with last sync time
+        if stamp_last_sync:
+            devices = Device.objects.filter(tags=tag_id('tailscale'))
+            if device_ids is not None:
+                devices = devices.filter(pk__in=device_ids)
+            for device in devices:
+                device.custom_field_data['tailscale_last_sync'] = \
+                    datetime.now().isoformat()
+                device.save()
+
     def run(self, data, commit):
         api_key = data['tailscale_api_key']
         tailnet = "tail84d4c.ts.net"
+        strip_suffixes = [
+            s.strip() for s in (data.get('strip_suffixes') or '').split(',') if s.strip()
+        ]
 
-        # Tailscale API endpoint
-        url = f"https://api.tailscale.com/api/v2/tailnet/{tailnet}/devices"
+        try:
+            state_file = state_path(self.STATE_DIR, data['state_file']) if data.get('state_file') else None
+            liveness_file = state_path(self.STATE_DIR, data['liveness_file']) if data.get('liveness_file') else None
+        except ValidationError as e:
+            self.log_failure('; '.join(e.messages))
+            return
+
+        # Resolve the reference objects up front, later lookups are served from the cache
+        try:
+            device_role_id('server')
+            tag_id('tailscale')
+        except ObjectDoesNotExist as e:
+            self.log_warning(f"No devices to sync: {e}")
+            return
+        except MultipleObjectsReturned as e:
+            self.log_failure(str(e))
+            return
 
-        headers = {
-            "Authorization": f"Bearer {api_key}"
-        }
+        client = TailscaleClient(api_key, tailnet, base_url=self.API_URL, cache=cache)
+        self.track_session(client.session)
 
+        executor = ThreadPoolExecutor(max_workers=1)
+        # Stream the node list on a worker thread while the database is queried
+        nodes = Prefetcher(client.iter_devices(), executor)
         try:
-            # Get Tailscale nodes
-            response = requests.get(url, headers=headers)
-            response.raise_for_status()
-            tailscale_nodes = response.json().get('devices', [])
 
-            # Create a map of hostname to online status
+            # Map every in-scope device by node ID, normalised hostname and IP, refreshed from the change log
+            with self.phase('match'):
+                index, reloaded = DeviceMatchIndex.refresh(
+                    self.get_devices(),
+                    strip_suffixes,
+                    scope=(device_role_id('server'), tag_id('tailscale'))
+                )
+            if reloaded is None:
+                self.log_debug(f"Rebuilt the device match index from {len(index.keys)} devices")
+            else:
+                self.log_debug(f"Device match index updated from {reloaded} changed devices")
+
+            # Map matched devices to their online status, and nodes to their verdict
+            device_status = {}
+            node_devices = {}
             node_status = {}
-            for node in tailscale_nodes:
-                # Remove tailnet suffix and convert to lowercase
-                hostname = node['hostname'].split('.')[0].lower()
-                # Consider a node online if it was seen in the last 10 minutes
-                last_seen = datetime.fromisoformat(node['lastSeen'].replace('Z', '+00:00'))
-                is_online = (datetime.now(timezone.utc) - last_seen).total_seconds() < 600  # 10 minutes
-                #self.log_debug(f"Tailscale node {hostname} is online: {is_online}")
-                node_status[hostname] = is_online
-
-            # Update NetBox devices with active status
-            devices_updated = 0
-            for device in Device.objects.filter(
-                tags__name__in=['tailscale'],
-                role__name__in=['server'],
-                status__in=[
-                    DeviceStatusChoices.STATUS_ACTIVE,
-                    DeviceStatusChoices.STATUS_PLANNED,
-                    DeviceStatusChoices.STATUS_OFFLINE,
-                ]
-            ):
-                hostname = device.name.lower()
-                if hostname in node_status:
-                    is_online = node_status[hostname]
-                    #self.log_debug(f"NetBox device {hostname} is online: {is_online} - netbox: {device.status}")
-                    new_status = (
-                        DeviceStatusChoices.STATUS_ACTIVE if is_online
-                        else DeviceStatusChoices.STATUS_OFFLINE
+            unmatched = 0
+            now = datetime.now(timezone.utc)
+            with self.phase('fetch'):
+                for node in nodes:
+                    # Consider a node online if it was seen in the last 10 minutes
+                    is_online = (
+                        node.last_seen is not None
+                        and (now - node.last_seen).total_seconds() < 600  # 10 minutes
                     )
+                    node_key = node.node_id or normalise_hostname(node.hostname, strip_suffixes)
+                    node_status[node_key] = is_online
+
+                    device_id = index.match(node)
+                    if device_id is None:
+                        unmatched += 1
+                        continue
+                    #self.log_debug(f"Tailscale node {node.hostname} is online: {is_online}")
+                    node_devices[node_key] = device_id
+                    # A device with several nodes counts as online if any of them is
+                    device_status[device_id] = device_status.get(device_id, False) or is_online
 
-                    if device.status != new_status:
-                        old_status = device.status
-                        device.status = new_status
-                        if commit:
-                            device.save()
-                            devices_updated += 1
-                            self.log_success(
-                                f"Updated {device.name} status from "
-                                f"{old_status} to {new_status}"
-                            )
-                        else:
-                            self.log_info(
-                                f"Would update {device.name} status from "
-                                f"{old_status} to {new_status}"
-                            )
+            if client.not_modified:
+                self.log_info("Tailscale device list unchanged since the last fetch, using cached copy")
+            if unmatched:
+                self.log_info(f"{unmatched} Tailscale nodes did not match any NetBox device")
+
+            # In incremental mode only the devices whose node verdict flipped are synced
+            device_ids = None
+            store = None
+            if data.get('incremental'):
+                if state_file:
+                    store = FileNodeStateStore(state_file)
                 else:
-                    self.log_warning(
-                        f"Device {device.name} not found in Tailscale nodes"
+                    store = CacheNodeStateStore(tailnet)
+                previous = store.load()
+                if previous is None:
+                    self.log_info("No previous node snapshot found, running a full sync")
+                else:
+                    changed = diff_node_states(previous, node_status)
+                    device_ids = {
+                        node_devices[key] for key in changed if key in node_devices
+                    }
+                    self.log_info(
+                        f"{len(changed)} of {len(node_status)} Tailscale nodes "
+                        f"changed state since the last run"
                     )
 
-            # Update custom field with last sync time
-            if commit:
-                self.log_success(f"Updated {devices_updated} devices")
-                for device in Device.objects.filter(tags__name='tailscale'):
-                    device.custom_field_data['tailscale_last_sync'] = \
-                        datetime.now().isoformat()
-                    device.save()
+            if device_ids is not None and not device_ids:
+                self.log_info("No Tailscale node changed state, nothing to update")
+            elif not commit:
+                plan = self.plan_status_changes(device_status, device_ids, data.get('stamp_last_sync'))
+                self.log_info("Dry run, nothing was written")
+                return plan.render() + "\n"
+            else:
+                with self.phase('write'):
+                    if data.get('bulk_mode'):
+                        self.bulk_sync(device_status, device_ids, data.get('stamp_last_sync'))
+                    else:
+                        self.sync(device_status, device_ids, data.get('stamp_last_sync'))
+
+            # Only advance the snapshot once the job's changes are committed
+            if store is not None and commit:
+                transaction.on_commit(lambda: store.save(node_status))
+
+            if liveness_file and commit:
+                liveness = LivenessLog(liveness_file)
+                transaction.on_commit(lambda: self.log_info(
+                    f"Recorded {liveness.record(device_status)} liveness transitions"
+                ))
 
         except requests.exceptions.RequestException as e:
             self.log_failure(f"Failed to query Tailscale API: {str(e)}")
             raise
+        finally:
+            # Stop the download first, shutdown() would otherwise wait on a full queue
+            nodes.close()
+            executor.shutdown()
+            client.close()
+
+
+class TailscaleAvailabilityReport(InstrumentedScriptMixin, Script):
+    class Meta:
+        name = "Tailscale Availability Report"
+        description = "Reports device uptime and flap counts from the Tailscale liveness log"
+        commit_default = False
+
+    # Directory the Tailscale Status Sync script keeps its liveness logs in
+    STATE_DIR = TailscaleStatusSync.STATE_DIR
+
+    liveness_file = StringVar(
+        description="File name of the liveness log written by the Tailscale Status Sync script",
+        required=True
+    )
+
+    window_days = IntegerVar(
+        description="Length of the reporting window in days",
+        default=7,
+        min_value=1
+    )
+
+    def run(self, data, commit):
+        end = time.time()
+        start = end - data['window_days'] * 86400
+
+        try:
+            liveness_file = state_path(self.STATE_DIR, data['liveness_file'])
+        except ValidationError as e:
+            self.log_failure('; '.join(e.messages))
+            return
+
+        with self.phase('read'):
+            availability = LivenessLog(liveness_file).availability(start, end)
+        if not availability:
+            self.log_warning("No liveness records found")
+            return
+
+        names = dict(
+            Device.objects.filter(pk__in=availability).values_list('pk', 'name')
+        )
+        known = [a for a in availability.values() if a.uptime is not None]
+        known.sort(key=lambda a: (a.uptime, -a.flaps))
+
+        if known:
+            fleet_uptime = (
+                100.0 * sum(a.online_seconds for a in known) / sum(a.known_seconds for a in known)
+            )
+            self.log_info(
+                f"Fleet availability over {data['window_days']} days: {fleet_uptime:.2f}% "
+                f"across {len(known)} devices, {sum(a.flaps for a in known)} flaps"
+            )
+
+        lines = [f"{'Device':<32} {'Uptime':>8} {'Flaps':>6}  Now"]
+        for a in known:
+            name = names.get(a.device_id, f"#{a.device_id} (deleted)")
+            lines.append(
+                f"{name:<32} {a.uptime:>7.2f}% {a.flaps:>6}  {'online' if a.online else 'offline'}"
+            )
+        return '\n'.join(lines) + '\n'
@@ -0,0 +1,141 @@
+"""
+Tailscale API client used by the Tailscale scripts.
+
+Requests share one keep-alive session with timeouts. The device list is
+fetched conditionally: the last ETag and a compact copy of the node list are
+kept in a cache, so an unchanged tailnet costs a single 304 response. When
+the optional ijson package is installed, the device list is parsed
+incrementally from the response stream instead of loading the whole JSON
+document. Prefetcher runs that stream on a worker thread through a bounded
+queue, so the download overlaps database work without buffering the whole
+list.
+"""
+import queue
+import threading
+from collections import namedtuple
+from datetime import datetime
+
+import requests
+
+try:
+    import ijson
+except ImportError:
+    ijson = None
+
+TailscaleNode = namedtuple('TailscaleNode', ['hostname', 'last_seen', 'node_id', 'addresses'])
+
+
+def parse_timestamp(value):
+    if not value:
+        return None
+    return datetime.fromisoformat(value.replace('Z', '+00:00'))
+
+
+class TailscaleClient:
+    API_URL = "https://api.tailscale.com/api/v2"
+
+    def __init__(self, api_key, tailnet, base_url=None, cache=None, timeout=(5, 60)):
+        self.tailnet = tailnet
+        self.base_url = (base_url or self.API_URL).rstrip('/')
+        self.cache = cache
+        self.timeout = timeout
+        self.cache_key = f"tailscale_api:devices:v2:{tailnet}"
+        # Set after each fetch: True if the server answered 304 Not Modified
+        self.not_modified = False
+
+        self.session = requests.Session()
+        self.session.headers.update({
+            'Authorization': f"Bearer {api_key}",
+            'Accept': 'application/json',
+        })
+
+    def close(self):
+        self.session.close()
+
+    def _iter_raw_devices(self, response):
+        if ijson is not None:
+            response.raw.decode_content = True
+            yield from ijson.items(response.raw, 'devices.item')
+        else:
+            yield from response.json().get('devices', [])
+
+    def iter_devices(self):
+        """
+        Yield a TailscaleNode(hostname, last_seen, node_id, addresses) per
+        tailnet device.
+
+        The cached copy is only replaced once the generator is fully consumed.
+        """
+        cached = self.cache.get(self.cache_key) if self.cache is not None else None
+        headers = {}
+        if cached:
+            headers['If-None-Match'] = cached['etag']
+
+        url = f"{self.base_url}/tailnet/{self.tailnet}/devices"
+        with self.session.get(url, headers=headers, timeout=self.timeout, stream=True) as response:
+            if response.status_code == 304 and cached:
+                self.not_modified = True
+                for hostname, last_seen, node_id, addresses in cached['nodes']:
+                    yield TailscaleNode(hostname, parse_timestamp(last_seen), node_id, addresses)
+                return
+
+            response.raise_for_status()
+            self.not_modified = False
+            etag = response.headers.get('ETag')
+            nodes = []
+            for device in self._iter_raw_devices(response):
+                hostname = device['hostname']
+                last_seen = device.get('lastSeen')
+                node_id = device.get('nodeId')
+                addresses = device.get('addresses') or []
+                if etag:
+                    nodes.append((hostname, last_seen, node_id, addresses))
+                yield TailscaleNode(hostname, parse_timestamp(last_seen), node_id, addresses)
+
+        if etag and self.cache is not None:
+            self.cache.set(self.cache_key, {'etag': etag, 'nodes': nodes}, timeout=None)
+
+
+class Prefetcher:
+    """
+    Consume `iterable` on an executor thread into a queue of at most `maxsize`
+    items. Iterating the Prefetcher yields the items in order and re-raises
+    the producer's exception at the end. close() stops the producer early.
+    """
+    _DONE = object()
+
+    def __init__(self, iterable, executor, maxsize=1000):
+        self._queue = queue.Queue(maxsize)
+        self._stop = threading.Event()
+        self._future = executor.submit(self._produce, iter(iterable))
+
+    def _put(self, item):
+        # Wait for room, but give up once the consumer has gone away
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def _produce(self, iterator):
+        try:
+            for item in iterator:
+                if not self._put(item):
+                    break
+        finally:
+            if hasattr(iterator, 'close'):
+                iterator.close()
+            self._put(self._DONE)
+
+    def __iter__(self):
+        while True:
+            item = self._queue.get()
+            if item is self._DONE:
+                self._future.result()
+                return
+            yield item
+
+    def close(self):
+        self._stop.set()
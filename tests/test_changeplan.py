@@ -0,0 +1,60 @@
+from changeplan import ChangePlan
+
+
+def test_empty_plan():
+    plan = ChangePlan()
+    assert len(plan) == 0
+    assert plan.render() == "No changes"
+    assert plan.apply() == []
+
+
+def test_zero_counts_are_not_recorded():
+    plan = ChangePlan()
+    assert plan.create('sites', count=0) is None
+    assert len(plan) == 0
+
+
+def test_entries_merge_and_samples_are_bounded():
+    plan = ChangePlan(sample_size=3)
+    plan.update('devices', count=2, samples=['a', 'b'], changes={'status': (None, 'offline')})
+    plan.update('devices', count=3, samples=['c', 'd', 'e'], changes={'status': (None, 'offline')})
+    plan.update('devices', samples=['f'], changes={'status': (None, 'active')})
+    assert len(plan) == 6
+    assert plan.render() == (
+        "~ 5 devices (status -> offline): a, b, c and 2 more\n"
+        "~ 1 devices (status -> active): f"
+    )
+
+
+def test_render_symbols_and_old_values():
+    plan = ChangePlan()
+    plan.create('sites', samples=['new'])
+    plan.update('site', changes={'status': ('active', 'decommissioning')})
+    plan.delete('racks', count=4)
+    assert plan.render().splitlines() == [
+        "+ 1 sites: new",
+        "~ 1 site (status: active -> decommissioning)",
+        "- 4 racks",
+    ]
+
+
+def test_samples_are_read_lazily():
+    consumed = []
+
+    def names():
+        for i in range(1000):
+            consumed.append(i)
+            yield f"device-{i}"
+
+    plan = ChangePlan(sample_size=2)
+    plan.update('devices', count=1000, samples=names())
+    assert consumed == [0, 1]
+
+
+def test_steps_run_in_order():
+    calls = []
+    plan = ChangePlan()
+    plan.step(calls.append, 'first')
+    plan.step(lambda value=None: calls.append(value) or len(calls), value='second')
+    assert plan.apply() == [None, 2]
+    assert calls == ['first', 'second']
@@ -0,0 +1,132 @@
+import pytest
+import requests
+
+from confluence import ConfluencePublisher, content_hash
+from stub_servers import ConfluenceStub
+
+
+class FlakyConfluenceStub(ConfluenceStub):
+    """Answers the first requests with the queued error statuses."""
+
+    def __init__(self):
+        super().__init__()
+        self.failures = []
+
+    def handle(self, method, path, headers, body):
+        with self.lock:
+            status = self.failures.pop(0) if self.failures else None
+        if status is not None:
+            return status, {'Retry-After': '0'} if status == 429 else {}, {'message': 'try again'}
+        return super().handle(method, path, headers, body)
+
+
+@pytest.fixture(scope='module')
+def server():
+    stub = FlakyConfluenceStub().start()
+    yield stub
+    stub.stop()
+
+
+@pytest.fixture
+def stub(server):
+    server.failures = []
+    server.reset_calls()
+    return server
+
+
+@pytest.fixture
+def publisher(stub):
+    publisher = ConfluencePublisher(f"{stub.url}/wiki", 'user', 'token', backoff=0, max_retries=2)
+    yield publisher
+    publisher.close()
+
+
+def test_publish_skips_unchanged_content(stub, publisher):
+    page_id = stub.create_page('Report')
+    assert publisher.publish(page_id, 'Report', '<p>1</p>') is True
+    assert stub.pages[page_id]['version'] == 2
+    assert stub.pages[page_id]['body'] == '<p>1</p>'
+
+    stub.reset_calls()
+    assert publisher.publish(page_id, 'Report', '<p>1</p>') is False
+    assert stub.calls['PUT'] == 0
+    assert stub.pages[page_id]['version'] == 2
+
+
+def test_fingerprint_ignores_volatile_content(stub, publisher):
+    page_id = stub.create_page('Report')
+    assert publisher.publish(page_id, 'Report', 'table at 10:00', fingerprint='table') is True
+    assert publisher.publish(page_id, 'Report', 'table at 11:00', fingerprint='table') is False
+    assert publisher.get_stored_hash(page_id)[0] == content_hash('table')
+
+
+def test_publish_with_prefetched_state(stub, publisher):
+    page_id = stub.create_page('Report')
+    state = publisher.get_page_state(page_id)
+    assert state.version == 1 and state.stored_hash is None
+
+    stub.reset_calls()
+    assert publisher.publish(page_id, 'Report', 'body', state=state) is True
+    # No reads needed: one page update and one property write
+    assert stub.calls == {'PUT': 1, 'POST': 1}
+
+
+def test_publish_retries_on_a_newer_page_version(stub, publisher):
+    page_id = stub.create_page('Report')
+    state = publisher.get_page_state(page_id)
+    # Someone edits the page after its state was fetched
+    stub.pages[page_id]['version'] = 5
+
+    assert publisher.publish(page_id, 'Report', 'body', state=state) is True
+    assert stub.pages[page_id]['version'] == 6
+    assert stub.pages[page_id]['body'] == 'body'
+    assert publisher.get_stored_hash(page_id)[0] == content_hash('body')
+
+
+@pytest.mark.parametrize('status', [429, 500, 502, 503, 504])
+def test_transient_errors_are_retried(stub, publisher, status):
+    page_id = stub.create_page('Report')
+    stub.failures = [status, status]
+    assert publisher.get_page(page_id)['version']['number'] == 1
+    assert stub.calls['GET'] == 3
+
+
+def test_retries_are_bounded(stub, publisher):
+    page_id = stub.create_page('Report')
+    stub.failures = [503, 503, 503]
+    with pytest.raises(requests.HTTPError):
+        publisher.get_page(page_id)
+    assert stub.calls['GET'] == 3
+
+
+def test_client_errors_are_not_retried(stub, publisher):
+    with pytest.raises(requests.HTTPError):
+        publisher.get_page('999')
+    assert stub.calls['GET'] == 1
+
+
+def test_publish_many_creates_missing_pages(stub, publisher):
+    parent_id = stub.create_page('Parent')
+    existing_id = stub.create_page('Report - A', parent_id=parent_id)
+    pages = [
+        (existing_id, 'Report - A', 'a', None),
+        (None, 'Report - B', 'b', None),
+    ]
+    assert publisher.publish_many(pages, workers=2, space_key='BENCH', parent_id=parent_id) == {
+        'Report - A': True,
+        'Report - B': True,
+    }
+    children = publisher.get_child_pages(parent_id)
+    assert set(children) == {'Report - A', 'Report - B'}
+    assert stub.pages[children['Report - B']]['body'] == 'b'
+
+    # The created page stored its hash, so a second run changes nothing
+    pages[1] = (children['Report - B'], 'Report - B', 'b', None)
+    assert publisher.publish_many(pages, workers=2) == {'Report - A': False, 'Report - B': False}
+
+
+def test_publish_many_reports_failures_per_page(stub, publisher):
+    page_id = stub.create_page('Report')
+    results = publisher.publish_many([(page_id, 'Report', 'x', None), ('999', 'Missing', 'y', None)])
+    assert results['Report'] is True
+    assert isinstance(results['Missing'], requests.HTTPError)
@@ -0,0 +1,71 @@
+import pytest
+
+from liveness import RECORD, LivenessLog
+
+
+@pytest.fixture
+def log(tmp_path):
+    return LivenessLog(str(tmp_path / 'liveness.log'))
+
+
+def test_missing_log_is_empty(log):
+    assert log.history() == {}
+    assert log.availability(0, 100) == {}
+
+
+def test_only_transitions_are_recorded(log):
+    assert log.record({1: True, 2: False}, timestamp=100) == 2
+    assert log.record({1: True, 2: False}, timestamp=200) == 0
+    assert log.record({1: False, 2: False}, timestamp=300) == 1
+    assert log.history() == {1: [(100, True), (300, False)], 2: [(100, False)]}
+    assert log.history(device_ids={2}) == {2: [(100, False)]}
+
+
+def test_availability_over_a_window(log):
+    log.record({1: True}, timestamp=100)
+    log.record({1: False}, timestamp=200)
+    log.record({1: True}, timestamp=250)
+
+    availability = log.availability(100, 400)[1]
+    assert availability.known_seconds == 300
+    assert availability.online_seconds == 250
+    assert availability.flaps == 2
+    assert availability.online is True
+    assert availability.uptime == pytest.approx(100 * 250 / 300)
+
+
+def test_time_before_the_first_record_is_unknown(log):
+    log.record({1: False}, timestamp=150)
+    availability = log.availability(0, 250)[1]
+    assert availability.known_seconds == 100
+    assert availability.online_seconds == 0
+    assert availability.uptime == 0
+
+
+def test_state_carries_into_the_window(log):
+    log.record({1: True}, timestamp=10)
+    log.record({1: False}, timestamp=1000)
+    availability = log.availability(100, 200)[1]
+    assert availability.known_seconds == 100
+    assert availability.online_seconds == 100
+    assert availability.flaps == 0
+
+
+def test_device_without_known_time_has_no_uptime(log):
+    log.record({1: True}, timestamp=500)
+    assert log.availability(0, 500)[1].uptime is None
+
+
+def test_partial_record_is_ignored(log):
+    log.record({1: True}, timestamp=100)
+    with open(log.path, 'ab') as f:
+        f.write(RECORD.pack(2, 200, 1)[:5])
+    assert log.history() == {1: [(100, True)]}
+
+
+def test_record_after_a_partial_record_stays_aligned(log):
+    log.record({1: True}, timestamp=100)
+    with open(log.path, 'ab') as f:
+        f.write(RECORD.pack(2, 200, 1)[:5])
+    assert log.record({2: True}, timestamp=300) == 1
+    assert log.history() == {1: [(100, True)], 2: [(300, True)]}
@@ -0,0 +1,82 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+
+from tailscale_api import Prefetcher
+
+
+@pytest.fixture
+def executor():
+    executor = ThreadPoolExecutor(max_workers=1)
+    yield executor
+    executor.shutdown()
+
+
+def test_items_arrive_in_order_through_a_small_queue(executor):
+    assert list(Prefetcher(range(1000), executor, maxsize=3)) == list(range(1000))
+
+
+def test_empty_iterable(executor):
+    assert list(Prefetcher([], executor)) == []
+
+
+def test_queue_bounds_how_far_the_producer_runs_ahead(executor):
+    produced = []
+    blocked = threading.Event()
+
+    def items():
+        for i in range(100):
+            produced.append(i)
+            if len(produced) == 4:
+                blocked.set()
+            yield i
+
+    prefetcher = Prefetcher(items(), executor, maxsize=3)
+    try:
+        assert blocked.wait(timeout=5)
+        time.sleep(0.3)
+        # Three queued items plus the one waiting for room
+        assert len(produced) == 4
+        assert list(prefetcher) == list(range(100))
+    finally:
+        prefetcher.close()
+
+
+def test_producer_errors_are_raised_after_the_items(executor):
+    def items():
+        yield 1
+        yield 2
+        raise RuntimeError('download failed')
+
+    received = []
+    with pytest.raises(RuntimeError, match='download failed'):
+        for item in Prefetcher(items(), executor):
+            received.append(item)
+    assert received == [1, 2]
+
+
+def test_close_unblocks_a_producer_on_a_full_queue():
+    executor = ThreadPoolExecutor(max_workers=1)
+    closed = threading.Event()
+
+    def items():
+        try:
+            i = 0
+            while True:
+                yield i
+                i += 1
+        finally:
+            closed.set()
+
+    prefetcher = Prefetcher(items(), executor, maxsize=2)
+    assert next(iter(prefetcher)) == 0
+    prefetcher.close()
+
+    done = threading.Thread(target=executor.shutdown)
+    done.start()
+    done.join(timeout=5)
+    assert not done.is_alive()
+    # The source generator was closed as well
+    assert closed.is_set()
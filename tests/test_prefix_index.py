@@ -0,0 +1,143 @@
+import pytest
+from netaddr import IPNetwork
+
+from prefix_index import PrefixIndex
+
+
+def make_index(*entries):
+    index = PrefixIndex()
+    index.load(
+        (network, container, network) for network, container in
+        ((entry, False) if isinstance(entry, str) else entry for entry in entries)
+    )
+    return index
+
+
+def test_empty_index_has_no_conflicts():
+    index = PrefixIndex()
+    assert len(index) == 0
+    assert index.conflicts('10.0.0.0/24') == []
+    assert not index.overlaps('10.0.0.0/24')
+
+
+def test_equal_prefix_conflicts():
+    index = make_index('10.0.0.0/24')
+    assert index.conflicts('10.0.0.0/24') == ['10.0.0.0/24']
+
+
+def test_nested_prefix_conflicts_both_ways():
+    index = make_index('10.0.0.0/16', '192.168.1.0/26')
+    # Existing ancestor
+    assert index.conflicts('10.0.5.0/24') == ['10.0.0.0/16']
+    # Existing descendant
+    assert index.conflicts('192.168.0.0/16') == ['192.168.1.0/26']
+
+
+def test_container_ancestor_is_not_a_conflict():
+    index = make_index(('10.0.0.0/8', True))
+    assert index.conflicts('10.1.0.0/24') == []
+    # An equal container prefix is still a collision
+    assert index.conflicts('10.0.0.0/8') == ['10.0.0.0/8']
+
+
+def test_disjoint_prefixes_do_not_conflict():
+    index = make_index('10.0.0.0/24', '10.0.2.0/24', '2001:db8::/48')
+    assert not index.overlaps('10.0.1.0/24')
+    assert not index.overlaps('2001:db8:1::/48')
+    assert index.overlaps('2001:db8::/32')
+
+
+def test_conflicts_limit():
+    index = make_index(*(f'10.0.{i}.0/24' for i in range(20)))
+    assert len(index.conflicts('10.0.0.0/16', limit=5)) == 5
+
+
+def test_next_free_fills_gaps_in_order():
+    index = make_index(('10.0.0.0/16', True), '10.0.0.0/24', '10.0.2.0/24')
+    assert index.next_free('10.0.0.0/16', 24, count=3) == [
+        IPNetwork('10.0.1.0/24'), IPNetwork('10.0.3.0/24'), IPNetwork('10.0.4.0/24'),
+    ]
+
+
+def test_next_free_aligns_to_block_size():
+    index = make_index('10.0.0.0/26')
+    # The gap after the /26 starts at .64, the next aligned /24 is 10.0.1.0
+    assert index.next_free('10.0.0.0/16', 24) == [IPNetwork('10.0.1.0/24')]
+    assert index.next_free('10.0.0.0/24', 26) == [IPNetwork('10.0.0.64/26')]
+
+
+def test_next_free_skips_nested_children():
+    index = make_index('10.0.0.0/23', '10.0.0.0/24', '10.0.1.128/25')
+    assert index.next_free('10.0.0.0/22', 24) == [IPNetwork('10.0.2.0/24')]
+
+
+def test_next_free_returns_empty_when_full():
+    index = make_index('10.0.0.0/25', '10.0.0.128/25')
+    assert index.next_free('10.0.0.0/24', 25) == []
+
+
+@pytest.mark.parametrize('length', [15, 33])
+def test_next_free_rejects_lengths_outside_the_supernet(length):
+    with pytest.raises(ValueError):
+        PrefixIndex().next_free('10.0.0.0/16', length)
+
+
+def test_add_and_remove():
+    index = make_index(('10.0.0.0/16', True))
+    index.add('10.0.0.0/24')
+    index.add('10.0.0.0/24', label='again')
+    assert len(index) == 3
+    assert index.next_free('10.0.0.0/16', 24) == [IPNetwork('10.0.1.0/24')]
+
+    index.remove('10.0.0.0/24')
+    assert index.conflicts('10.0.0.0/24') == ['10.0.0.0/24']
+    index.remove('10.0.0.0/24')
+    assert index.conflicts('10.0.0.0/24') == []
+    assert index.next_free('10.0.0.0/16', 24) == [IPNetwork('10.0.0.0/24')]
+    assert len(index) == 1
+
+    with pytest.raises(KeyError):
+        index.remove('10.0.0.0/24')
+
+
+def test_next_free_resumes_after_removing_a_block():
+    index = make_index(('10.0.0.0/16', True))
+    for _ in range(3):
+        index.add(index.next_free('10.0.0.0/16', 24)[0])
+    index.remove('10.0.1.0/24')
+    assert index.next_free('10.0.0.0/16', 24) == [IPNetwork('10.0.1.0/24')]
+
+
+def test_next_free_sees_children_added_below_its_hint():
+    index = make_index(('10.0.0.0/16', True))
+    assert index.next_free('10.0.0.0/16', 24) == [IPNetwork('10.0.0.0/24')]
+    # A wider prefix covering the hinted address is added without going through next_free
+    index.add('10.0.0.0/22')
+    assert index.next_free('10.0.0.0/16', 24) == [IPNetwork('10.0.4.0/24')]
+    assert index.next_free('10.0.0.0/16', 23, count=2) == [IPNetwork('10.0.4.0/23'), IPNetwork('10.0.6.0/23')]
+
+
+def test_allocation_cost_stays_flat_as_the_pool_fills():
+    index = make_index(('10.0.0.0/8', True))
+    # Pre-existing children, walked once by the first search
+    index.load((f'10.{i // 256}.{i % 256}.0/24', False, 'existing') for i in range(20000))
+    walked = 0
+    entries = index._entries[4]
+
+    class CountingList(list):
+        def __getitem__(self, position):
+            nonlocal walked
+            walked += 1
+            return list.__getitem__(self, position)
+
+    index._entries[4] = CountingList(entries)
+    index.next_free('10.0.0.0/8', 24)
+    batches = []
+    for _ in range(5):
+        walked = 0
+        for _ in range(400):
+            index.add(index.next_free('10.0.0.0/8', 24)[0])
+        batches.append(walked)
+    # The last 400 allocations cost no more than the first 400 (logarithmic inserts aside)
+    assert batches[-1] <= batches[0] * 1.5
+    assert batches[0] < 400 * 30
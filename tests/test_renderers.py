@@ -0,0 +1,51 @@
+import csv
+import io
+import json
+
+from renderers import (
+    Column, CSVRenderer, HTMLTableRenderer, JSONRenderer, ShardedRenderer, TextRenderer, render_rows
+)
+
+COLUMNS = [Column('device', 'Device'), Column('site', 'Site')]
+
+ROWS = [('web-1', 'Berlin'), ('web-2', 'Paris'), ('db<1>', 'Berlin')]
+
+
+def test_render_rows_feeds_every_renderer_once():
+    text = TextRenderer(COLUMNS, "{device} at {site}")
+    csv_output = CSVRenderer(COLUMNS)
+    json_output = JSONRenderer(COLUMNS)
+    assert render_rows(iter(ROWS), [text, csv_output, json_output]) == 3
+
+    assert text.getvalue() == "web-1 at Berlin\nweb-2 at Paris\ndb<1> at Berlin"
+    assert list(csv.reader(io.StringIO(csv_output.getvalue()))) == [['Device', 'Site']] + [list(r) for r in ROWS]
+    assert json.loads(json_output.getvalue()) == [{'device': d, 'site': s} for d, s in ROWS]
+
+
+def test_empty_reports():
+    json_output = JSONRenderer(COLUMNS)
+    html = HTMLTableRenderer(COLUMNS)
+    assert render_rows([], [json_output, html]) == 0
+    assert json_output.getvalue() == '[]'
+    assert html.getvalue() == (
+        '<table class="table"><thead><tr><th>Device</th><th>Site</th></tr></thead><tbody></tbody></table>'
+    )
+
+
+def test_html_escapes_values():
+    html = HTMLTableRenderer(COLUMNS)
+    render_rows([('db<1>', 'A & B')], [html])
+    assert '<td>db&lt;1&gt;</td><td>A &amp; B</td>' in html.getvalue()
+
+
+def test_sharded_renderer_splits_rows_by_column():
+    sharded = ShardedRenderer(COLUMNS, 'site', lambda columns: TextRenderer(columns, "{device}"))
+    render_rows(ROWS, [sharded])
+    assert sharded.getvalue() == {'Berlin': "web-1\ndb<1>", 'Paris': "web-2"}
+
+
+def test_sharded_html_tables_are_complete():
+    sharded = ShardedRenderer(COLUMNS, 'site', HTMLTableRenderer)
+    render_rows(ROWS, [sharded])
+    for table in sharded.getvalue().values():
+        assert table.startswith('<table') and table.endswith('</table>')